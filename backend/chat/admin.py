@@ -1,7 +1,15 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Message, Group, Profile
+from .models import ConversationSummary, Friendship, GroupReadState, Message, MessageDeletion, Group, Profile, Poll, PollVote, ResourceVersion, Upload
 admin.site.register(Message)
+admin.site.register(MessageDeletion)
+admin.site.register(Poll)
+admin.site.register(PollVote)
+admin.site.register(ConversationSummary)
+admin.site.register(GroupReadState)
+admin.site.register(ResourceVersion)
 admin.site.register(Group)
 admin.site.register(Profile)
+admin.site.register(Friendship)
+admin.site.register(Upload)
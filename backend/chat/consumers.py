@@ -0,0 +1,44 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import User
+
+from .events import user_group
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes chat events to a connected user.
+
+    The user comes from the session cookie, or from the ``username`` query
+    parameter like the rest of the API.
+    """
+
+    async def connect(self):
+        self.group_name = None
+        user = await self.get_user()
+        if user is None:
+            await self.close()
+            return
+        self.group_name = user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def chat_event(self, event):
+        await self.send_json({'type': event['event'], 'data': event['data'], 'seq': event['seq']})
+
+    @database_sync_to_async
+    def get_user(self):
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            return user
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        username = query.get('username', [None])[0]
+        if not username:
+            return None
+        return User.objects.filter(username=username).first()
@@ -0,0 +1,100 @@
+"""
+Chat events: the per-user change feed and real-time push.
+
+Views call these helpers inside the transaction of the write they report.
+Each event is stored once (ChangeEvent) and appended to the change feed of
+every recipient by reference (one small Change row each, read by the sync
+endpoint), then pushed to connected clients once it commits. Every
+connection of a user joins the ``user_<id>`` group on the channel layer
+(see consumers.py).
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .models import Change, ChangeEvent, Group, Message
+
+
+def user_group(user_id):
+    """Channel layer group that every connection of a user joins"""
+    return f'user_{user_id}'
+
+
+def message_recipients(msg):
+    """User ids that can see a message: both DM participants or all group members"""
+    if msg.group_id:
+        recipients = set(msg.group.members.values_list('id', flat=True))
+        recipients.add(msg.sender_id)
+        return recipients
+    return {msg.sender_id, msg.receiver_id}
+
+
+def publish(user_ids, event, data):
+    """Record an event in each user's change feed and push it to their connections once the transaction commits"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    with transaction.atomic():
+        change_event = ChangeEvent.objects.create(kind=event, data=data)
+        changes = Change.objects.bulk_create(Change(user_id=user_id, event=change_event) for user_id in user_ids)
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def send():
+        for change in changes:
+            async_to_sync(channel_layer.group_send)(
+                user_group(change.user_id),
+                {'type': 'chat.event', 'event': event, 'data': data, 'seq': change.id},
+            )
+
+    transaction.on_commit(send)
+
+
+def message_created(msg, message_data):
+    publish(message_recipients(msg), 'message.new', {'group_id': msg.group_id, 'message': message_data})
+
+
+def message_deleted(msg, user_ids, delete_type):
+    publish(user_ids, 'message.deleted', {'id': msg.id, 'group_id': msg.group_id, 'type': delete_type})
+
+
+def poll_voted(msg, vote_data):
+    publish(message_recipients(msg), 'poll.voted', {'group_id': msg.group_id, **vote_data})
+
+
+def conversation_read(reader, partner, up_to_id):
+    # The reader too: their unread counts changed, and feed-based ETags must move
+    publish({reader.id, partner.id}, 'conversation.read', {'reader': reader.username, 'up_to_id': up_to_id})
+
+
+def group_read(reader, group, up_to_id):
+    recipients = set(group.members.values_list('id', flat=True)) | {reader.id}
+    publish(recipients, 'group.read', {'group_id': group.id, 'reader': reader.username, 'up_to_id': up_to_id})
+
+
+def group_created(group):
+    publish(group.members.values_list('id', flat=True), 'group.created', {'group_id': group.id, 'name': group.name})
+
+
+def group_member_changed(group, user, event, recipients):
+    publish(recipients, event, {'group_id': group.id, 'username': user.username})
+
+
+def upload_processed(upload):
+    """Tell everyone who can see a message using the upload that its imageVariants are ready"""
+    messages = Message.objects.filter(image_upload=upload)
+    recipients = set()
+    for sender_id, receiver_id in messages.values_list('sender_id', 'receiver_id'):
+        recipients.add(sender_id)
+        if receiver_id is not None:
+            recipients.add(receiver_id)
+    recipients.update(Group.members.through.objects.filter(
+        group__in=messages.exclude(group=None).values('group')
+    ).values_list('user_id', flat=True))
+    publish(recipients, 'upload.processed', {'sha256': upload.sha256})
+
+
+def friend_changed(user, friend, event):
+    publish([user.id], event, {'user_id': friend.id, 'username': friend.username})
+    publish([friend.id], event, {'user_id': user.id, 'username': user.username})
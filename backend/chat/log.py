@@ -0,0 +1,40 @@
+"""
+Logging helpers referenced from ``LOGGING`` in settings.
+
+``SamplingFilter`` lets only a fraction of low-severity records through so
+chatty per-request logs stay cheap under load, and ``JSONFormatter`` writes
+one JSON object per line with any ``extra=`` fields as top-level keys.
+"""
+import json
+import logging
+import random
+
+# Attributes every LogRecord has; anything else was passed through ``extra=``
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class SamplingFilter(logging.Filter):
+    """Pass records below ``always_level`` with probability ``rate``; pass the rest unconditionally"""
+    def __init__(self, rate=1.0, always_level='WARNING'):
+        super().__init__()
+        self.rate = float(rate)
+        self.always_level = logging.getLevelName(always_level) if isinstance(always_level, str) else always_level
+
+    def filter(self, record):
+        if record.levelno >= self.always_level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RESERVED_ATTRS)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
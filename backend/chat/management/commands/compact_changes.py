@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from chat.models import Change, ChangeEvent
+
+
+class Command(BaseCommand):
+    help = "Delete change feed entries older than the retention window (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=settings.CHANGE_FEED_RETENTION_DAYS,
+            help="Keep entries newer than this many days",
+        )
+
+    def handle(self, *args, **options):
+        latest = Change.objects.order_by('-id').values_list('id', flat=True).first()
+        if latest is None:
+            return
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Always keep the newest entry so the sync endpoint can tell how far the feed was compacted
+        deleted, _ = Change.objects.filter(created_at__lt=cutoff, id__lt=latest).delete()
+        # Events are shared by their recipients' entries; drop those no entry points at any more
+        orphaned, _ = ChangeEvent.objects.filter(created_at__lt=cutoff).exclude(
+            Exists(Change.objects.filter(event=OuterRef('pk')))
+        ).delete()
+        self.stdout.write(
+            f"Deleted {deleted} change feed entries and {orphaned} events older than {cutoff:%Y-%m-%d %H:%M}"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Upload
+from chat.thumbnails import Image, generate_variants, is_image
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants and blur placeholders for image uploads that do not have them yet"
+
+    def handle(self, *args, **options):
+        if Image is None:
+            self.stderr.write("Pillow is not installed; nothing to do")
+            return
+        pending = [upload for upload in Upload.objects.filter(placeholder='') if is_image(upload)]
+        for upload in pending:
+            generate_variants(upload.pk)
+        self.stdout.write(f"Processed {len(pending)} image uploads")
@@ -0,0 +1,357 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from contextlib import ExitStack
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+from chat.middleware import QueryTracker
+from chat.models import Friendship, Group
+
+API = '/api/chat'
+
+# Client polling intervals in seconds, as in App.js and GroupPage.js
+POLL_INTERVALS = {
+    'chat': 2,            # open DM conversation
+    'group_chat': 2,      # open group conversation
+    'new_chats': 3,       # check-new-chats
+    'unread': 3,          # every other friend and group, for unread badges
+    'groups': 5,          # group list
+}
+
+
+class InProcessTransport:
+    """Requests through Django's test client in this process; counts DB queries per request"""
+    def __init__(self):
+        self.client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+
+    def request(self, method, path, body=None, headers=None):
+        tracker = QueryTracker()
+        extra = {'HTTP_' + name.upper().replace('-', '_'): value for name, value in (headers or {}).items()}
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracker))
+            if method == 'GET':
+                response = self.client.get(path, **extra)
+            else:
+                data = json.dumps(body) if body is not None else ''
+                response = self.client.generic(method, path, data, content_type='application/json', **extra)
+        return response.status_code, response.content, response.headers, tracker.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Requests against a running server; query counts are not available (see /metrics there)"""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=dict(headers or {}))
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.read(), response.headers, None
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read(), exc.headers, None
+
+    def close(self):
+        pass
+
+
+class VirtualUser(threading.Thread):
+    """One simulated browser session: the client's polling loops plus occasional writes"""
+    def __init__(self, options, transport, profile, shared, stop_at):
+        super().__init__(daemon=True)
+        self.options = options
+        self.transport = transport
+        self.username = profile['username']
+        self.friends = profile['friends']
+        self.groups = profile['groups']
+        self.shared = shared
+        self.stop_at = stop_at
+        self.rng = random.Random(f"{options['seed']}-{self.username}")
+        self.etags = {}
+        self.own_messages = []
+        self.stats = {}
+
+    # -- measurement --
+
+    def call(self, label, method, path, body=None):
+        headers = {}
+        if method == 'GET' and self.options['etags'] and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        start = time.perf_counter()
+        try:
+            status, content, response_headers, queries = self.transport.request(method, path, body, headers)
+        except Exception:
+            status, content, response_headers, queries = 'error', b'', {}, None
+        elapsed = time.perf_counter() - start
+
+        stats = self.stats.setdefault(label, {'latencies': [], 'statuses': Counter(), 'queries': [], 'bytes': 0})
+        stats['latencies'].append(elapsed)
+        stats['statuses'][status] += 1
+        stats['bytes'] += len(content)
+        if queries is not None:
+            stats['queries'].append(queries)
+        if method == 'GET' and status == 200 and response_headers.get('ETag'):
+            self.etags[path] = response_headers['ETag']
+        if status in (200, 201) and content:
+            try:
+                return json.loads(content)
+            except ValueError:
+                return None
+        return None
+
+    # -- client behaviour --
+
+    def poll_chat(self):
+        if self.friends:
+            self.call('messages', 'GET', f"{API}/messages/user1={self.username}&user2={self.friends[0]}/")
+
+    def poll_group_chat(self):
+        if self.groups:
+            self.call('group_messages', 'GET', f"{API}/group_messages/?group_id={self.groups[0]}&username={self.username}")
+
+    def poll_new_chats(self):
+        self.call('check_new_chats', 'GET', f"{API}/check-new-chats/?username={self.username}")
+
+    def poll_unread(self):
+        # The client refetches every other conversation to count unread messages
+        for friend in self.friends[1:]:
+            self.call('messages', 'GET', f"{API}/messages/user1={self.username}&user2={friend}/")
+        for group_id in self.groups[1:]:
+            self.call('group_messages', 'GET', f"{API}/group_messages/?group_id={group_id}&username={self.username}")
+
+    def poll_groups(self):
+        self.call('group_list', 'GET', f"{API}/groups/")
+
+    def send(self):
+        roll = self.rng.random()
+        if self.groups and roll < 0.3:
+            body = {'sender': self.username, 'group_id': self.rng.choice(self.groups), 'content': self.text()}
+            data = self.call('send_group', 'POST', f"{API}/group_messages/", body)
+            message_id = data and data.get('id')
+        elif self.friends:
+            partner = self.rng.choice(self.friends)
+            body = {'sender': self.username, 'receiver': partner, 'content': self.text()}
+            if roll > 0.9:
+                body.update(type='poll', poll={'question': 'Lunch?', 'options': ['Yes', 'No', 'Later']})
+            data = self.call('send', 'POST', f"{API}/send/", body)
+            message_id = data and data['message']['id']
+            if message_id and body.get('type') == 'poll':
+                with self.shared['lock']:
+                    self.shared['polls'].append((message_id, {self.username, partner}))
+        else:
+            return
+        if message_id:
+            self.own_messages.append(message_id)
+
+    def vote(self):
+        with self.shared['lock']:
+            polls = [message_id for message_id, members in self.shared['polls'][-50:] if self.username in members]
+        if polls:
+            body = {'message_id': self.rng.choice(polls), 'voter': self.username, 'selected': [self.rng.randrange(3)]}
+            self.call('vote', 'POST', f"{API}/poll/vote/", body)
+
+    def delete(self):
+        if self.own_messages:
+            message_id = self.own_messages.pop(self.rng.randrange(len(self.own_messages)))
+            delete_type = 'for_everyone' if self.rng.random() < 0.2 else 'for_me'
+            self.call('delete', 'DELETE', f"{API}/messages/{message_id}/?type={delete_type}&username={self.username}")
+
+    def text(self):
+        return ' '.join(self.rng.choice(('hey', 'ok', 'see you', 'on my way', 'lol', 'sounds good', 'what time?'))
+                        for _ in range(self.rng.randint(1, 6)))
+
+    def run(self):
+        speed = self.options['speed']
+        intervals = [
+            (POLL_INTERVALS['chat'], self.poll_chat),
+            (POLL_INTERVALS['group_chat'], self.poll_group_chat),
+            (POLL_INTERVALS['new_chats'], self.poll_new_chats),
+            (POLL_INTERVALS['unread'], self.poll_unread),
+            (POLL_INTERVALS['groups'], self.poll_groups),
+            (self.options['send_interval'], self.send),
+            (self.options['vote_interval'], self.vote),
+            (self.options['delete_interval'], self.delete),
+        ]
+        now = time.monotonic()
+        # Browsers open at different moments; spread the first tick over each interval
+        schedule = [[now + self.rng.uniform(0, interval / speed), interval / speed, action]
+                    for interval, action in intervals if interval > 0]
+        try:
+            while True:
+                task = min(schedule, key=lambda entry: entry[0])
+                now = time.monotonic()
+                if task[0] >= self.stop_at or now >= self.stop_at:
+                    break
+                delay = task[0] - now
+                if delay > 0:
+                    time.sleep(delay)
+                task[2]()
+                task[0] += task[1]
+        finally:
+            self.transport.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent users replaying the web client's polling pattern "
+        "(2 s chat, 3 s new-chats/unread, 5 s groups, plus sends, votes and deletes) "
+        "and report throughput, p50/p95/p99 latency and queries per request per endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Concurrent simulated users")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run")
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help="Divide every client interval by this factor (e.g. 4 = four times the request rate)")
+        parser.add_argument('--url', help="Base URL of a running server (default: run the app in-process)")
+        parser.add_argument('--existing', action='store_true',
+                            help="Act as existing users that have friends instead of creating loadtest_* users")
+        parser.add_argument('--friends', type=int, default=4, help="Friends per generated user")
+        parser.add_argument('--group-size', type=int, default=6, help="Members per generated group")
+        parser.add_argument('--send-interval', type=float, default=10, help="Seconds between messages per user (0 = never)")
+        parser.add_argument('--vote-interval', type=float, default=20, help="Seconds between poll votes per user (0 = never)")
+        parser.add_argument('--delete-interval', type=float, default=60, help="Seconds between deletes per user (0 = never)")
+        parser.add_argument('--no-etags', dest='etags', action='store_false',
+                            help="Do not revalidate with If-None-Match (browsers do by default)")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help="Also write the results as JSON to this file")
+        parser.add_argument('--max-p95', type=float,
+                            help="Fail (exit status 1) when any endpoint's p95 latency exceeds this many milliseconds")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError("--users must be at least 1")
+        profiles = self.existing_profiles(options) if options['existing'] else self.fixture_profiles(options)
+        if not profiles:
+            raise CommandError("No users with friends to simulate; run without --existing or seed the database first")
+        connections.close_all()
+
+        shared = {'lock': threading.Lock(), 'polls': []}
+        start = time.monotonic()
+        stop_at = start + options['duration']
+        workers = [
+            VirtualUser(options, HTTPTransport(options['url']) if options['url'] else InProcessTransport(),
+                        profile, shared, stop_at)
+            for profile in profiles
+        ]
+        self.stdout.write(
+            f"Simulating {len(workers)} users for {options['duration']:g}s "
+            f"({'against ' + options['url'] if options['url'] else 'in-process'}, speed x{options['speed']:g})"
+        )
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - start
+
+        results = self.summarize(workers, elapsed)
+        self.report(results, elapsed)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as out:
+                json.dump({'options': {k: v for k, v in options.items() if k in (
+                    'users', 'duration', 'speed', 'url', 'existing', 'etags', 'seed')},
+                    'elapsed': elapsed, 'endpoints': results}, out, indent=2)
+        if options['max_p95'] is not None:
+            slow = [label for label, row in results.items() if row['p95_ms'] > options['max_p95']]
+            if slow:
+                raise CommandError(f"p95 above {options['max_p95']:g} ms for: {', '.join(sorted(slow))}")
+
+    def fixture_profiles(self, options):
+        """Create (idempotently) loadtest_* users in a friendship ring and overlapping groups"""
+        count = options['users']
+        users = []
+        for i in range(count):
+            user, created = User.objects.get_or_create(username=f'loadtest_{i}')
+            if created:
+                user.set_unusable_password()
+                user.save(update_fields=['password'])
+            users.append(user)
+        profiles = []
+        for i, user in enumerate(users):
+            friends = [users[(i + step) % count] for step in range(1, min(options['friends'], count - 1) + 1)]
+            for friend in friends:
+                Friendship.befriend(user, friend)
+        group_size = max(2, options['group_size'])
+        # Each group starts half a group after the previous one, so every user is in about two groups
+        stride = max(1, group_size // 2)
+        for start in range(0, count, stride):
+            group, _ = Group.objects.get_or_create(name=f'loadtest group {start}')
+            group.members.add(*[users[(start + j) % count] for j in range(min(group_size, count))])
+        for user in users:
+            profiles.append(self.profile(user))
+        return profiles
+
+    def existing_profiles(self, options):
+        users = User.objects.filter(friendships__isnull=False).distinct().order_by('id')[:options['users']]
+        return [self.profile(user) for user in users]
+
+    def profile(self, user):
+        return {
+            'username': user.username,
+            'friends': list(User.objects.filter(friend_of__user=user).order_by('id').values_list('username', flat=True)),
+            'groups': list(user.chat_groups.order_by('id').values_list('id', flat=True)),
+        }
+
+    def summarize(self, workers, elapsed):
+        merged = {}
+        for worker in workers:
+            for label, stats in worker.stats.items():
+                row = merged.setdefault(label, {'latencies': [], 'statuses': Counter(), 'queries': [], 'bytes': 0})
+                row['latencies'].extend(stats['latencies'])
+                row['statuses'].update(stats['statuses'])
+                row['queries'].extend(stats['queries'])
+                row['bytes'] += stats['bytes']
+        results = {}
+        for label, row in sorted(merged.items()):
+            latencies = sorted(row['latencies'])
+            count = len(latencies)
+            errors = sum(n for status, n in row['statuses'].items() if status == 'error' or status >= 400)
+            results[label] = {
+                'requests': count,
+                'rps': count / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+                'queries_per_request': sum(row['queries']) / len(row['queries']) if row['queries'] else None,
+                'bytes_per_request': row['bytes'] / count if count else 0,
+                'not_modified': row['statuses'].get(304, 0),
+                'errors': errors,
+                'statuses': {str(status): n for status, n in sorted(row['statuses'].items(), key=str)},
+            }
+        return results
+
+    def report(self, results, elapsed):
+        header = f"{'endpoint':<16} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'q/req':>6} {'304':>6} {'errors':>6}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        total = 0
+        for label, row in results.items():
+            total += row['requests']
+            queries = f"{row['queries_per_request']:.1f}" if row['queries_per_request'] is not None else '-'
+            self.stdout.write(
+                f"{label:<16} {row['requests']:>7} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+                f"{row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {queries:>6} {row['not_modified']:>6} {row['errors']:>6}"
+            )
+        self.stdout.write(f"Total: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
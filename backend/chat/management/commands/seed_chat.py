@@ -0,0 +1,370 @@
+import bisect
+import itertools
+import json
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.models import (
+    ConversationSummary, Friendship, Group, GroupReadState, Message, MessageDeletion, Poll,
+    PollOption, PollVote, Profile, ResourceVersion, conversation_key, message_preview,
+)
+
+FIRST_NAMES = ['Aarav', 'Maya', 'Liam', 'Zoe', 'Ishan', 'Nina', 'Omar', 'Sara', 'Kiran', 'Leo', 'Ana', 'Ravi', 'Mei', 'Jonas', 'Priya', 'Tom']
+LAST_NAMES = ['Shah', 'Patel', 'Smith', 'Garcia', 'Kim', 'Novak', 'Rossi', 'Khan', 'Mehta', 'Silva', 'Chen', 'Brown']
+WORDS = ('hey hi ok sure thanks lol yes no maybe tomorrow today tonight meeting lunch dinner call me later '
+         'running late on my way see you soon sounds good what time where are you did you see this nice '
+         'great awesome haha project deadline notes exam class homework weekend plan movie game').split()
+GROUP_TOPICS = ['Study group', 'Project', 'Family', 'Friends', 'Weekend plans', 'Football', 'Book club', 'Roommates', 'Team', 'Trip']
+POLL_QUESTIONS = [('Lunch?', ['Yes', 'No', 'Later']), ('Meeting time?', ['10am', '2pm', '5pm', 'Tomorrow']),
+                  ('Movie tonight?', ['In', 'Out']), ('Where to eat?', ['Pizza', 'Sushi', 'Burgers', 'Tacos'])]
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the timestamps we generate instead of auto_now_add's now()"""
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+class WeightedPicker:
+    """O(log n) weighted choice from a fixed population"""
+    def __init__(self, population, weights, rng):
+        self.population = population
+        self.cumulative = list(itertools.accumulate(weights))
+        self.rng = rng
+
+    def pick(self):
+        index = bisect.bisect_right(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.population[min(index, len(self.population) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a large synthetic dataset (users, profiles, friendships, groups, DMs and group "
+        "messages with polls, attachments and deletions) using batched inserts. Activity follows a "
+        "Zipf-like distribution and the output is deterministic for a given --seed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--dms', type=int, default=200000, help="Direct messages to create")
+        parser.add_argument('--group-messages', type=int, default=100000)
+        parser.add_argument('--avg-friends', type=float, default=15)
+        parser.add_argument('--max-group-size', type=int, default=200)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="Zipf exponent of per-user activity (0 = uniform)")
+        parser.add_argument('--poll-ratio', type=float, default=0.01)
+        parser.add_argument('--image-ratio', type=float, default=0.04)
+        parser.add_argument('--document-ratio', type=float, default=0.015)
+        parser.add_argument('--delete-for-me-ratio', type=float, default=0.02)
+        parser.add_argument('--delete-for-everyone-ratio', type=float, default=0.005)
+        parser.add_argument('--days', type=float, default=180, help="Spread messages over this many days")
+        parser.add_argument('--start', default='2024-01-01', help="Date of the first message (YYYY-MM-DD)")
+        parser.add_argument('--prefix', default='seed', help="Username prefix of generated users")
+        parser.add_argument('--password', default='password', help="Password of every generated user")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("--users must be at least 2")
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Users named {options['prefix']}_* already exist; pick another --prefix")
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.start = datetime.strptime(options['start'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+
+        with explicit_timestamps(
+            Message._meta.get_field('timestamp'),
+            MessageDeletion._meta.get_field('deleted_at'),
+            PollVote._meta.get_field('created_at'),
+            Friendship._meta.get_field('created_at'),
+        ):
+            users, weights = self.create_users()
+            friends = self.create_friendships(users, weights)
+            groups = self.create_groups(users, weights)
+            self.create_messages(users, weights, friends, groups)
+
+        # Bulk inserts skip the signals that normally invalidate list ETags
+        ResourceVersion.bump('users')
+        ResourceVersion.bump('groups')
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    # -- users and relationships --
+
+    def create_users(self):
+        count, prefix = self.options['users'], self.options['prefix']
+        # One hash for everyone (fixed salt keeps the output deterministic); hashing per user would dominate
+        password = make_password(self.options['password'], salt=f"{prefix}{self.options['seed']}salt")
+        joined = self.start - timedelta(days=30)
+        new_users = [
+            User(
+                username=f"{prefix}_{i}", password=password, date_joined=joined,
+                first_name=self.rng.choice(FIRST_NAMES), last_name=self.rng.choice(LAST_NAMES),
+            )
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(new_users, batch_size=self.batch_size)
+            users = list(User.objects.filter(username__startswith=f"{prefix}_").order_by('id'))
+            # bulk_create skips the post_save signal that creates profiles
+            Profile.objects.bulk_create(
+                [Profile(user=user, email=f"{user.username}@example.com",
+                         mobile_number=f"+1555{self.rng.randrange(10 ** 7):07d}") for user in users],
+                batch_size=self.batch_size,
+            )
+        # Zipf-Mandelbrot activity: a few users send most messages and have most friends,
+        # with the head flattened so the busiest user is not in every conversation
+        ranks = list(range(1, count + 1))
+        self.rng.shuffle(ranks)
+        weights = [1 / (rank + 10) ** self.options['skew'] for rank in ranks]
+        self.stdout.write(f"Created {count} users with profiles")
+        return users, weights
+
+    def create_friendships(self, users, weights):
+        count = len(users)
+        mean_weight = sum(weights) / count
+        picker = WeightedPicker(range(count), weights, self.rng)
+        edges = set()
+        for i in range(count):
+            # Degree follows activity (preferential attachment), at least one friend each
+            degree = max(1, min(count - 1, round(self.options['avg_friends'] / 2 * weights[i] / mean_weight)))
+            for _ in range(degree):
+                j = picker.pick()
+                if j != i:
+                    edges.add((min(i, j), max(i, j)))
+        edges = sorted(edges)
+        created_at = self.start - timedelta(days=1)
+        rows = (
+            Friendship(user=users[a], friend=users[b], created_at=created_at)
+            for i, j in edges for a, b in ((i, j), (j, i))
+        )
+        with transaction.atomic():
+            Friendship.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.stdout.write(f"Created {len(edges)} friendships")
+        return edges
+
+    def create_groups(self, users, weights):
+        count = len(users)
+        picker = WeightedPicker(range(count), weights, self.rng)
+        groups = Group.objects.bulk_create(
+            [Group(name=f"{self.rng.choice(GROUP_TOPICS)} {n + 1}") for n in range(self.options['groups'])],
+            batch_size=self.batch_size,
+        )
+        Membership = Group.members.through
+        memberships = []
+        members_by_group = []
+        for group in groups:
+            # Mostly small groups with a long tail of large ones
+            size = min(count, self.options['max_group_size'], 2 + int(self.rng.paretovariate(1.5) * 2))
+            members = set()
+            while len(members) < size:
+                members.add(picker.pick())
+            members = sorted(members)
+            members_by_group.append(members)
+            memberships.extend(Membership(group_id=group.id, user_id=users[m].id) for m in members)
+        with transaction.atomic():
+            Membership.objects.bulk_create(memberships, batch_size=self.batch_size)
+        self.stdout.write(f"Created {len(groups)} groups with {len(memberships)} memberships")
+        return list(zip(groups, members_by_group))
+
+    # -- messages --
+
+    def create_messages(self, users, weights, friends, groups):
+        options = self.options
+        dm_total, group_total = options['dms'], options['group_messages']
+        if not friends:
+            dm_total = 0
+        if not groups:
+            group_total = 0
+        total = dm_total + group_total
+        if not total:
+            return
+
+        pair_picker = WeightedPicker(friends, [weights[a] + weights[b] for a, b in friends], self.rng) if friends else None
+        group_picker = WeightedPicker(
+            groups, [sum(weights[m] for m in members) for _, members in groups], self.rng
+        ) if groups else None
+        member_pickers = {group.id: WeightedPicker(members, [weights[m] for m in members], self.rng)
+                          for group, members in groups}
+        span = timedelta(days=options['days'])
+        dm_share = dm_total / total
+        self.summaries = {}       # (owner index, partner index) -> summary fields
+        self.group_last_ids = {}  # group id -> [last message id, id at the read checkpoint]
+        checkpoint_taken = False
+        created = {'dm': 0, 'group': 0, 'polls': 0, 'deletions': 0}
+
+        for batch_start in range(0, total, self.batch_size):
+            batch = []
+            for n in range(batch_start, min(total, batch_start + self.batch_size)):
+                timestamp = self.start + span * (n / total)
+                if (created['dm'] < dm_total and self.rng.random() < dm_share) or created['group'] >= group_total:
+                    a, b = pair_picker.pick()
+                    sender, receiver = (a, b) if self.rng.random() < weights[a] / (weights[a] + weights[b]) else (b, a)
+                    batch.append(self.build_message(users, timestamp, sender, receiver=receiver))
+                    created['dm'] += 1
+                else:
+                    group, members = group_picker.pick()
+                    sender = member_pickers[group.id].pick()
+                    batch.append(self.build_message(users, timestamp, sender, group=group, members=members))
+                    created['group'] += 1
+            polls, deletions = self.insert_batch(users, batch)
+            created['polls'] += polls
+            created['deletions'] += deletions
+            if batch_start + len(batch) >= total * 0.9 and not checkpoint_taken:
+                # Members last read their groups around here; later messages stay unread
+                for ids in self.group_last_ids.values():
+                    ids[1] = ids[0]
+                checkpoint_taken = True
+            self.stdout.write(f"  {batch_start + len(batch)}/{total} messages")
+
+        self.write_read_state(users, groups)
+        self.stdout.write(
+            f"Created {created['dm']} direct and {created['group']} group messages, "
+            f"{created['polls']} polls, {created['deletions']} per-user deletions"
+        )
+
+    def build_message(self, users, timestamp, sender, receiver=None, group=None, members=None):
+        """An unsaved Message plus the extras (poll, deletions) to insert once it has an id"""
+        options, rng = self.options, self.rng
+        message = Message(sender=users[sender], timestamp=timestamp)
+        if group is not None:
+            message.group = group
+            participants = members
+        else:
+            message.receiver = users[receiver]
+            message.conversation = conversation_key(users[sender].id, users[receiver].id)
+            participants = [sender, receiver]
+
+        extras = {'sender': sender, 'receiver': receiver, 'poll': None, 'deleted_for': []}
+        roll = rng.random()
+        if roll < options['poll_ratio']:
+            question, choices = rng.choice(POLL_QUESTIONS)
+            allow_multiple = rng.random() < 0.2
+            message.content = json.dumps({'type': 'poll', 'question': question, 'options': choices, 'allowMultiple': allow_multiple})
+            voters = rng.sample(participants, min(len(participants), 20))
+            votes = []
+            for voter in voters:
+                if rng.random() < 0.6:
+                    picked = rng.sample(range(len(choices)), rng.randint(1, len(choices)) if allow_multiple else 1)
+                    votes.extend((voter, position) for position in picked)
+            extras['poll'] = (question, choices, allow_multiple, votes)
+        else:
+            message.content = ' '.join(rng.choice(WORDS) for _ in range(max(1, int(rng.expovariate(1 / 8)))))
+            roll -= options['poll_ratio']
+            if roll < options['image_ratio']:
+                message.imageUrl = f"http://localhost:8000/media/chat_uploads/seed_{rng.randrange(10 ** 6)}.jpg"
+                message.content = '' if rng.random() < 0.5 else message.content
+            elif roll < options['image_ratio'] + options['document_ratio']:
+                name = f"notes_{rng.randrange(10 ** 4)}.pdf"
+                message.documentUrl = f"http://localhost:8000/media/chat_uploads/{name}"
+                message.documentName = name
+
+        roll = rng.random()
+        if roll < options['delete_for_everyone_ratio']:
+            message.deleted_for_everyone = True
+            message.deleted_at = timestamp + timedelta(minutes=rng.randint(1, 600))
+        elif roll < options['delete_for_everyone_ratio'] + options['delete_for_me_ratio']:
+            extras['deleted_for'] = [rng.choice(participants)]
+        message._seed = extras
+        return message
+
+    def insert_batch(self, users, batch):
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)  # ids are returned on SQLite 3.35+/PostgreSQL
+            polls = []
+            for message in batch:
+                if message._seed['poll']:
+                    question, _, allow_multiple, _ = message._seed['poll']
+                    polls.append(Poll(message=message, question=question, allow_multiple=allow_multiple))
+            Poll.objects.bulk_create(polls)
+
+            options, votes = [], []
+            for poll in polls:
+                _, choices, _, poll_votes = poll.message._seed['poll']
+                counts = [0] * len(choices)
+                for _, position in poll_votes:
+                    counts[position] += 1
+                poll_options = [PollOption(poll=poll, position=position, text=text, vote_count=counts[position])
+                                for position, text in enumerate(choices)]
+                options.extend(poll_options)
+                poll._options = poll_options
+            PollOption.objects.bulk_create(options)
+            for poll in polls:
+                for voter, position in poll.message._seed['poll'][3]:
+                    votes.append(PollVote(poll=poll, option=poll._options[position], user=users[voter],
+                                          created_at=poll.message.timestamp + timedelta(minutes=5)))
+            PollVote.objects.bulk_create(votes)
+            # Cache each message's poll (or its absence) so message_preview() needs no query
+            by_message = {poll.message_id: poll for poll in polls}
+            for message in batch:
+                Message.poll.related.set_cached_value(message, by_message.get(message.id))
+
+            deletions = [
+                MessageDeletion(message=message, user=users[user_index],
+                                deleted_at=message.timestamp + timedelta(hours=1))
+                for message in batch for user_index in message._seed['deleted_for']
+            ]
+            MessageDeletion.objects.bulk_create(deletions)
+
+        for message in batch:
+            self.track(message)
+        return len(polls), len(deletions)
+
+    def track(self, message):
+        """Fold a message into the in-memory inbox/read state, mirroring ConversationSummary.record_message"""
+        extras = message._seed
+        if message.group_id:
+            ids = self.group_last_ids.setdefault(message.group_id, [0, 0])
+            ids[0] = message.id
+            return
+        sender, receiver = extras['sender'], extras['receiver']
+        for owner, partner in ((sender, receiver), (receiver, sender)):
+            row = self.summaries.setdefault((owner, partner), {
+                'last_message_id': None, 'last_preview': '', 'last_timestamp': None,
+                'unread_count': 0, 'last_read_id': 0,
+            })
+            if owner == sender:
+                # Replying means the sender has read the conversation
+                row['unread_count'] = 0
+                row['last_read_id'] = message.id
+            visible = not message.deleted_for_everyone and owner not in extras['deleted_for']
+            if not visible:
+                continue
+            if owner != sender:
+                row['unread_count'] += 1
+            row['last_message_id'] = message.id
+            row['last_preview'] = message_preview(message)
+            row['last_timestamp'] = message.timestamp
+
+    def write_read_state(self, users, groups):
+        summaries = (
+            ConversationSummary(owner=users[owner], partner=users[partner], **row)
+            for (owner, partner), row in self.summaries.items()
+        )
+        read_states = []
+        for group, members in groups:
+            last_id, checkpoint_id = self.group_last_ids.get(group.id, (0, 0))
+            for member in members:
+                # Most members are caught up; the rest stopped reading at the checkpoint
+                read_id = last_id if self.rng.random() < 0.7 else checkpoint_id
+                if read_id:
+                    read_states.append(GroupReadState(user=users[member], group=group, last_read_id=read_id))
+        with transaction.atomic():
+            ConversationSummary.objects.bulk_create(summaries, batch_size=self.batch_size)
+            GroupReadState.objects.bulk_create(read_states, batch_size=self.batch_size)
+        self.stdout.write(f"Created {len(self.summaries)} conversation summaries and {len(read_states)} group read states")
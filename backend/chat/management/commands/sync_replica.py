@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.routers import REPLICA_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into the replica configured by REPLICA_DATABASE_NAME, "
+        "once or every --interval seconds. Uses SQLite's online backup, so the primary keeps "
+        "serving reads and writes while it is copied"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep running and copy again every this many seconds (default: copy once)",
+        )
+
+    def handle(self, *args, **options):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            raise CommandError("No replica database configured; set REPLICA_DATABASE_NAME in settings")
+        primary = settings.DATABASES['default']
+        replica = settings.DATABASES[REPLICA_DB_ALIAS]
+        if not all(db['ENGINE'] == 'django.db.backends.sqlite3' for db in (primary, replica)):
+            raise CommandError("sync_replica only copies SQLite databases; replicate other databases with their own tooling")
+        if str(primary['NAME']) == str(replica['NAME']):
+            raise CommandError("The replica must be a different file from the primary")
+
+        timeout = primary.get('OPTIONS', {}).get('timeout', 5)
+        try:
+            while True:
+                start = time.perf_counter()
+                self.copy(primary['NAME'], replica['NAME'], timeout)
+                if options['verbosity'] >= 1:
+                    self.stdout.write(f"Copied primary to replica in {(time.perf_counter() - start) * 1000:.0f} ms")
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def copy(self, primary_name, replica_name, timeout):
+        # One step: a single read snapshot of the primary, so concurrent writes cannot restart the copy.
+        # Replica readers wait (up to their busy timeout) while the pages are replaced.
+        source = sqlite3.connect(primary_name, timeout=timeout)
+        target = sqlite3.connect(replica_name, timeout=timeout)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
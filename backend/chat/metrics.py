@@ -0,0 +1,115 @@
+"""
+In-process request metrics, rendered in the Prometheus text exposition format.
+
+Metrics live in module-level dicts guarded by one lock, so each server
+process keeps its own numbers; scrape every process (or run one) to get a
+complete picture.
+"""
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts = self.series.get(labels)
+        if counts is None:
+            # one slot per bucket plus +Inf, then sum
+            counts = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, counts in sorted(self.series.items()):
+            base = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = format_labels(self.label_names + ('le',), labels + (format_value(bound),))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{base} {format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{base} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{format_labels(self.label_names, labels)} {format_value(value)}')
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+_lock = threading.Lock()
+
+REQUESTS = Counter('chat_http_requests_total', 'HTTP requests by route, method and status code.', ('route', 'method', 'status'))
+LATENCY = Histogram('chat_http_request_duration_seconds', 'Request latency by route.', ('route', 'method'), LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram('chat_http_response_size_bytes', 'Response body size by route (before compression).', ('route', 'method'), SIZE_BUCKETS)
+DB_QUERIES = Histogram('chat_db_queries_per_request', 'Database queries issued per request.', ('route', 'method'), QUERY_BUCKETS)
+DB_TIME = Histogram('chat_db_query_duration_seconds_per_request', 'Time spent in database queries per request.', ('route', 'method'), LATENCY_BUCKETS)
+
+METRICS = [REQUESTS, LATENCY, RESPONSE_SIZE, DB_QUERIES, DB_TIME]
+
+
+def record_request(route, method, status, duration, size=None, queries=None, db_time=None):
+    """Record one finished request; ``size``/``queries``/``db_time`` are skipped when unknown"""
+    labels = (route, method)
+    with _lock:
+        REQUESTS.inc((route, method, str(status)))
+        LATENCY.observe(labels, duration)
+        if size is not None:
+            RESPONSE_SIZE.observe(labels, size)
+        if queries is not None:
+            DB_QUERIES.observe(labels, queries)
+            DB_TIME.observe(labels, db_time)
+
+
+def render_metrics():
+    """All metrics in Prometheus text format (version 0.0.4)"""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        for metric in METRICS:
+            metric.series.clear()
@@ -0,0 +1,144 @@
+import re
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+from .metrics import record_request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header (q-values honoured), or None"""
+    offered = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_RE.fullmatch(part)
+        if not match:
+            continue
+        try:
+            offered[match.group(1).lower()] = float(match.group(2) or 1)
+        except ValueError:
+            continue
+    wildcard = offered.get('*', 0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # On equal weight prefer the first candidate (brotli compresses JSON better)
+    best = max(candidates, key=lambda coding: offered.get(coding, wildcard))
+    return best if offered.get(best, wildcard) > 0 else None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli (when the ``brotli`` package is installed)
+    or gzip, whichever the client prefers. Bodies smaller than
+    ``COMPRESSION_MIN_SIZE`` bytes are sent as-is since compressing them
+    costs more than it saves; large message histories shrink several-fold.
+    Streaming responses are gzip-compressed on the fly.
+    """
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            coding = 'gzip'
+            del response.headers['Content-Length']
+        else:
+            if coding == 'br':
+                compressed = brotli.compress(response.content, quality=getattr(settings, 'BROTLI_QUALITY', 5))
+            else:
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # The body differs per encoding, so a strong ETag would no longer be valid
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
+
+
+class QueryTracker:
+    """``connection.execute_wrapper`` hook counting queries and the time spent in them"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def request_route(request):
+    """The matched URL pattern (e.g. 'api/chat/groups/<int:pk>/members/'), keeping label cardinality bounded"""
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else '<unmatched>'
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status, response size and DB query count/time per route
+    for the /metrics endpoint. Async views (long-poll) get latency and status
+    only, since their queries run on other threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        tracker = QueryTracker()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracker))
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, tracker)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, None)
+        return response
+
+    def record(self, request, response, duration, tracker):
+        size = None if response.streaming else len(response.content)
+        record_request(
+            request_route(request), request.method, response.status_code, duration, size,
+            tracker.count if tracker else None, tracker.duration if tracker else None,
+        )
+
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_deleted_for_users(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    MessageDeletion = apps.get_model('chat', 'MessageDeletion')
+    User = apps.get_model('auth', 'User')
+    existing_user_ids = set(User.objects.values_list('id', flat=True))
+    deletions = []
+    rows = Message.objects.exclude(deleted_for_users='').values_list('id', 'deleted_for_users')
+    for message_id, deleted_for_users in rows.iterator():
+        user_ids = {int(uid) for uid in deleted_for_users.split(',') if uid.strip().isdigit()}
+        deletions.extend(
+            MessageDeletion(message_id=message_id, user_id=user_id)
+            for user_id in user_ids & existing_user_ids
+        )
+    MessageDeletion.objects.bulk_create(deletions, batch_size=1000)
+
+
+def restore_deleted_for_users(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    MessageDeletion = apps.get_model('chat', 'MessageDeletion')
+    deleted_for = {}
+    for message_id, user_id in MessageDeletion.objects.values_list('message_id', 'user_id').iterator():
+        deleted_for.setdefault(message_id, []).append(str(user_id))
+    for message_id, user_ids in deleted_for.items():
+        Message.objects.filter(pk=message_id).update(deleted_for_users=','.join(user_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_message_deleted_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deletions', to='chat.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_deletions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'deleted_at'], name='chat_messag_user_id_e9c311_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'message'), name='unique_message_deletion')],
+            },
+        ),
+        migrations.RunPython(copy_deleted_for_users, restore_deleted_for_users),
+        migrations.RemoveField(
+            model_name='message',
+            name='deleted_for_users',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversation(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    rows = Message.objects.filter(group__isnull=True, receiver__isnull=False).only('id', 'sender_id', 'receiver_id')
+    batch = []
+    for msg in rows.iterator(chunk_size=2000):
+        low, high = sorted((msg.sender_id, msg.receiver_id))
+        msg.conversation = f"{low}:{high}"
+        batch.append(msg)
+        if len(batch) >= 2000:
+            Message.objects.bulk_update(batch, ['conversation'])
+            batch = []
+    Message.objects.bulk_update(batch, ['conversation'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_messagedeletion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True),
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['group', 'id'], name='message_group_idx'),
+        ),
+    ]
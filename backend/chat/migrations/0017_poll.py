@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:38
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_polls_from_content(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Poll = apps.get_model('chat', 'Poll')
+    PollOption = apps.get_model('chat', 'PollOption')
+    rows = Message.objects.filter(content__startswith='{').values_list('id', 'content')
+    for message_id, content in rows.iterator():
+        try:
+            data = json.loads(content)
+        except ValueError:
+            continue
+        if not isinstance(data, dict) or data.get('type') != 'poll':
+            continue
+        poll = Poll.objects.create(
+            message_id=message_id,
+            question=data.get('question') or '',
+            allow_multiple=bool(data.get('allowMultiple', False)),
+        )
+        PollOption.objects.bulk_create(
+            PollOption(poll=poll, position=position, text=str(text))
+            for position, text in enumerate(data.get('options') or [])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_message_conversation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Poll',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('allow_multiple', models.BooleanField(default=False)),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='poll', to='chat.message')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PollOption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='options', to='chat.poll')),
+            ],
+            options={
+                'ordering': ['position'],
+                'constraints': [models.UniqueConstraint(fields=('poll', 'position'), name='unique_poll_option_position')],
+            },
+        ),
+        migrations.RunPython(copy_polls_from_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_poll_votes(apps, schema_editor):
+    Poll = apps.get_model('chat', 'Poll')
+    PollOption = apps.get_model('chat', 'PollOption')
+    PollVote = apps.get_model('chat', 'PollVote')
+    User = apps.get_model('auth', 'User')
+    user_ids = dict(User.objects.values_list('username', 'id'))
+    for poll in Poll.objects.select_related('message').iterator():
+        poll_votes = poll.message.pollVotes
+        if not isinstance(poll_votes, dict) or not poll_votes:
+            continue
+        options = {option.position: option for option in PollOption.objects.filter(poll=poll)}
+        votes = []
+        for voter, selected in poll_votes.items():
+            # Voters were keyed by username, or by id for clients without one
+            user_id = user_ids.get(voter)
+            if user_id is None and str(voter).isdigit() and int(voter) in user_ids.values():
+                user_id = int(voter)
+            if user_id is None:
+                continue
+            if not isinstance(selected, list):
+                selected = [selected]
+            positions = {int(position) for position in selected if str(position).lstrip('-').isdigit()}
+            votes.extend(
+                PollVote(poll=poll, option=options[position], user_id=user_id)
+                for position in positions if position in options
+            )
+        PollVote.objects.bulk_create(votes, ignore_conflicts=True)
+        for option in options.values():
+            option.vote_count = PollVote.objects.filter(option=option).count()
+        PollOption.objects.bulk_update(options.values(), ['vote_count'])
+
+
+def restore_poll_votes(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    PollVote = apps.get_model('chat', 'PollVote')
+    poll_votes = {}
+    for message_id, username, position in PollVote.objects.values_list(
+        'poll__message_id', 'user__username', 'option__position'
+    ).iterator():
+        poll_votes.setdefault(message_id, {}).setdefault(username, []).append(position)
+    for message_id, votes in poll_votes.items():
+        Message.objects.filter(pk=message_id).update(pollVotes=votes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_poll'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='polloption',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PollVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('option', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='chat.polloption')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='chat.poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='poll_votes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['poll', 'user'], name='chat_pollvo_poll_id_39691a_idx')],
+                'constraints': [models.UniqueConstraint(fields=('option', 'user'), name='unique_poll_vote')],
+            },
+        ),
+        migrations.RunPython(copy_poll_votes, restore_poll_votes),
+        migrations.RemoveField(
+            model_name='message',
+            name='pollVotes',
+        ),
+    ]
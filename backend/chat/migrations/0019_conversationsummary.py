@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    MessageDeletion = apps.get_model('chat', 'MessageDeletion')
+    Poll = apps.get_model('chat', 'Poll')
+    ConversationSummary = apps.get_model('chat', 'ConversationSummary')
+    deleted = set(MessageDeletion.objects.values_list('message_id', 'user_id').iterator())
+    poll_questions = dict(Poll.objects.values_list('message_id', 'question').iterator())
+
+    latest = {}
+    rows = Message.objects.filter(
+        group__isnull=True, receiver__isnull=False, deleted_for_everyone=False
+    ).order_by('id')
+    for msg in rows.iterator(chunk_size=2000):
+        for owner_id, partner_id in {(msg.sender_id, msg.receiver_id), (msg.receiver_id, msg.sender_id)}:
+            if (msg.id, owner_id) not in deleted:
+                latest[owner_id, partner_id] = msg
+
+    def preview(msg):
+        if msg.id in poll_questions:
+            return f"Poll: {poll_questions[msg.id]}"[:100]
+        if msg.content:
+            return msg.content[:100]
+        if msg.imageUrl:
+            return "Photo"
+        if msg.documentUrl:
+            return (msg.documentName or "Document")[:100]
+        return ""
+
+    ConversationSummary.objects.bulk_create(
+        (
+            ConversationSummary(
+                owner_id=owner_id, partner_id=partner_id, last_message=msg,
+                last_preview=preview(msg), last_timestamp=msg.timestamp,
+            )
+            for (owner_id, partner_id), msg in latest.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_pollvote'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_preview', models.CharField(blank=True, default='', max_length=100)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to=settings.AUTH_USER_MODEL)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-last_timestamp'], name='summary_owner_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'partner'), name='unique_conversation_summary')],
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
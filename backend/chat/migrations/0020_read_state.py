@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_last_read(apps, schema_editor):
+    # Everything sent before read tracking existed counts as read; otherwise the
+    # first recount (ConversationSummary.refresh) would flag whole histories unread
+    Message = apps.get_model('chat', 'Message')
+    ConversationSummary = apps.get_model('chat', 'ConversationSummary')
+    latest = dict(
+        Message.objects.filter(group__isnull=True, conversation__isnull=False)
+        .values('conversation').annotate(latest=models.Max('id')).values_list('conversation', 'latest')
+        .iterator()
+    )
+    summaries = []
+    for summary in ConversationSummary.objects.only('id', 'owner_id', 'partner_id').iterator(chunk_size=2000):
+        low, high = sorted((summary.owner_id, summary.partner_id))
+        summary.last_read_id = latest.get(f"{low}:{high}", 0)
+        summaries.append(summary)
+    ConversationSummary.objects.bulk_update(summaries, ['last_read_id'], batch_size=1000)
+
+
+def backfill_group_read_states(apps, schema_editor):
+    # Existing members have read everything posted so far
+    Group = apps.get_model('chat', 'Group')
+    Message = apps.get_model('chat', 'Message')
+    GroupReadState = apps.get_model('chat', 'GroupReadState')
+    latest = dict(
+        Message.objects.filter(group__isnull=False)
+        .values('group').annotate(latest=models.Max('id')).values_list('group', 'latest')
+    )
+    GroupReadState.objects.bulk_create(
+        (
+            GroupReadState(user_id=user_id, group_id=group_id, last_read_id=latest.get(group_id, 0))
+            for group_id, user_id in Group.members.through.objects.values_list('group_id', 'user_id').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_conversationsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_last_read, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='GroupReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='chat.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'group'), name='unique_group_read_state')],
+            },
+        ),
+        migrations.RunPython(backfill_group_read_states, migrations.RunPython.noop),
+    ]
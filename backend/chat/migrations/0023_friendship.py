@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_friends(apps, schema_editor):
+    Friendship = apps.get_model('chat', 'Friendship')
+    Profile = apps.get_model('chat', 'Profile')
+    User = apps.get_model('auth', 'User')
+    user_ids = set(User.objects.values_list('id', flat=True))
+    edges = []
+    for user_id, friends in Profile.objects.values_list('user_id', 'friends').iterator():
+        if not isinstance(friends, list):
+            continue
+        # Keep edges as stored (legacy lists were meant to be mutual); drop stale ids
+        friend_ids = {int(f) for f in friends if str(f).isdigit()} & user_ids
+        friend_ids.discard(user_id)
+        edges.extend(Friendship(user_id=user_id, friend_id=friend_id) for friend_id in friend_ids)
+    Friendship.objects.bulk_create(edges, batch_size=500, ignore_conflicts=True)
+
+
+def restore_friends(apps, schema_editor):
+    Friendship = apps.get_model('chat', 'Friendship')
+    Profile = apps.get_model('chat', 'Profile')
+    friends = {}
+    for user_id, friend_id in Friendship.objects.values_list('user_id', 'friend_id').iterator():
+        friends.setdefault(user_id, []).append(friend_id)
+    for user_id, friend_ids in friends.items():
+        Profile.objects.filter(user_id=user_id).update(friends=friend_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_resourceversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_of', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'friend'), name='unique_friendship')],
+            },
+        ),
+        migrations.RunPython(copy_friends, restore_friends),
+        migrations.RemoveField(
+            model_name='profile',
+            name='friends',
+        ),
+    ]
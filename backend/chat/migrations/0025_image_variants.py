@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_image_uploads(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Upload = apps.get_model('chat', 'Upload')
+    for upload_id, sha256 in Upload.objects.values_list('id', 'sha256').iterator():
+        Message.objects.filter(imageUrl__contains=sha256).update(image_upload_id=upload_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0024_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='image_upload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.upload'),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(link_image_uploads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# A frozen copy of the DDL in chat.search as of this migration, so later changes there do not alter it
+
+INDEXED = "{row}.deleted_for_everyone = 0 AND {row}.content != ''"
+SEARCH_TEXT = """CASE WHEN json_valid({row}.content) THEN
+    CASE WHEN json_extract({row}.content, '$.type') = 'poll' THEN
+        coalesce(json_extract({row}.content, '$.question'), '') || ' ' || coalesce((
+            SELECT group_concat(value, ' ') FROM json_each({row}.content, '$.options') WHERE type = 'text'
+        ), '')
+    ELSE {row}.content END
+ELSE {row}.content END"""
+
+CREATE_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(
+        content, content='',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message
+        WHEN {INDEXED.format(row='new')} BEGIN
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, {SEARCH_TEXT.format(row='new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message
+        WHEN {INDEXED.format(row='old')} BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, {SEARCH_TEXT.format(row='old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content, deleted_for_everyone ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content)
+            SELECT 'delete', old.id, {SEARCH_TEXT.format(row='old')} WHERE {INDEXED.format(row='old')};
+        INSERT INTO chat_message_fts(rowid, content)
+            SELECT new.id, {SEARCH_TEXT.format(row='new')} WHERE {INDEXED.format(row='new')};
+    END""",
+    f"""INSERT INTO chat_message_fts(rowid, content)
+        SELECT id, {SEARCH_TEXT.format(row='chat_message')} FROM chat_message WHERE {INDEXED.format(row='chat_message')}""",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other databases search with chat.search.search_messages_fallback
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0025_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
@@ -1,16 +1,17 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from django.db.models import JSONField
+from django.db.models import Exists, F, OuterRef, Prefetch
+
+from .usercache import invalidate_user
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(blank=True, default='')
     email = models.EmailField(blank=True, default='')
     mobile_number = models.CharField(max_length=20, blank=True, default='')
-    friends = models.JSONField(default=list, blank=True)  # List of friend user IDs
 
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -22,7 +23,11 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # Logins only save last_login, which no serializer shows; saving the profile
+    # would bump the users version and invalidate every user list ETag
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
     try:
         instance.profile.save()
     except Profile.DoesNotExist:
@@ -37,19 +42,128 @@ class Group(models.Model):
     def __str__(self):
         return self.name
 
+class ResourceVersion(models.Model):
+    """Counter bumped whenever a shared resource changes, used to build cheap ETags"""
+    name = models.CharField(max_length=40, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls, name):
+        if not cls.objects.filter(name=name).update(version=F('version') + 1):
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(version=F('version') + 1)
+
+    @classmethod
+    def current(cls, *names):
+        """Current versions of the given resources, in order (0 if never bumped)"""
+        versions = dict(cls.objects.filter(name__in=names).values_list('name', 'version'))
+        return [versions.get(name, 0) for name in names]
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+# Profile is saved whenever its User is (see save_user_profile), so this covers user edits too
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=User)
+def bump_users_version(sender, **kwargs):
+    ResourceVersion.bump('users')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # After commit, so a concurrent lookup cannot re-cache the old row
+    user_id, username = instance.pk, instance.username
+    transaction.on_commit(lambda: invalidate_user(user_id, username))
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(m2m_changed, sender=Group.members.through)
+def bump_groups_version(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        ResourceVersion.bump('groups')
+
+class Friendship(models.Model):
+    """Directed friendship edge; befriend/unfriend always write both directions"""
+    user = models.ForeignKey(User, related_name='friendships', on_delete=models.CASCADE)
+    friend = models.ForeignKey(User, related_name='friend_of', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='unique_friendship'),
+        ]
+
+    @classmethod
+    def befriend(cls, user, friend):
+        """Create the mutual friendship; safe to call when it (partly) exists"""
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [cls(user=user, friend=friend), cls(user=friend, friend=user)],
+                ignore_conflicts=True,
+            )
+            ResourceVersion.bump('users')
+
+    @classmethod
+    def unfriend(cls, user, friend):
+        """Remove the friendship in both directions; returns False if ``user`` had no such friend"""
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(
+                models.Q(user=user, friend=friend) | models.Q(user=friend, friend=user)
+            ).delete()
+            ResourceVersion.bump('users')
+        return deleted > 0
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.friend_id}"
+
+def conversation_key(user_a_id, user_b_id):
+    """Canonical key shared by both directions of a direct-message conversation"""
+    low, high = sorted((user_a_id, user_b_id))
+    return f"{low}:{high}"
+
+class MessageQuerySet(models.QuerySet):
+    def with_related(self):
+        """Load everything MessageSerializer touches in a constant number of queries"""
+        return self.select_related('sender', 'receiver', 'poll', 'image_upload').prefetch_related(
+            'poll__options',
+            Prefetch('poll__votes', queryset=PollVote.objects.select_related('user', 'option')),
+        )
+
+    def visible_to(self, user):
+        """Exclude messages deleted for everyone or deleted by this user (as an anti-join)"""
+        return self.filter(deleted_for_everyone=False).filter(
+            ~Exists(MessageDeletion.objects.filter(message=OuterRef('pk'), user=user))
+        )
+
 class Message(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE, null=True, blank=True)
     group = models.ForeignKey(Group, related_name='messages', on_delete=models.CASCADE, null=True, blank=True)
+    conversation = models.CharField(max_length=41, null=True, blank=True, editable=False)  # conversation_key() of a DM, set on save
     content = models.TextField(blank=True)
     imageUrl = models.URLField(blank=True, null=True)
     documentUrl = models.URLField(blank=True, null=True)
     documentName = models.CharField(max_length=255, blank=True, null=True)
-    pollVotes = JSONField(blank=True, null=True, default=dict)
+    image_upload = models.ForeignKey('Upload', related_name='+', on_delete=models.SET_NULL, null=True, blank=True)  # Stored file behind imageUrl, for its variants
     timestamp = models.DateTimeField(auto_now_add=True)
-    # Track deleted messages
-    deleted_for_users = models.TextField(blank=True, default="")  # Comma-separated user IDs
+    # Track deleted messages (per-user deletions live in MessageDeletion)
     deleted_for_everyone = models.BooleanField(default=False)  # True if deleted for everyone
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)  # When deleted for everyone, for incremental sync
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        # Ids grow with timestamps, so history is read as a range scan on (conversation/group, id)
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='message_conversation_idx'),
+            models.Index(fields=['group', 'id'], name='message_group_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.receiver_id and not self.group_id:
+            self.conversation = conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         if self.group:
@@ -58,3 +172,259 @@ class Message(models.Model):
             return f"{self.sender.username} to {self.receiver.username}: {self.content[:20]}"
         else:
             return f"{self.sender.username}: {self.content[:20]}"
+
+class MessageDeletion(models.Model):
+    """A message hidden by one user ("delete for me")"""
+    message = models.ForeignKey(Message, related_name='deletions', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='message_deletions', on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'message'], name='unique_message_deletion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"Message {self.message_id} deleted for {self.user_id}"
+
+class Poll(models.Model):
+    """Poll attached to a message (the message content keeps its JSON form for older clients)"""
+    message = models.OneToOneField(Message, related_name='poll', on_delete=models.CASCADE)
+    question = models.TextField()
+    allow_multiple = models.BooleanField(default=False)
+
+    @classmethod
+    def create_for_message(cls, message, question, options, allow_multiple=False):
+        poll = cls.objects.create(message=message, question=question, allow_multiple=bool(allow_multiple))
+        PollOption.objects.bulk_create(
+            PollOption(poll=poll, position=position, text=str(text))
+            for position, text in enumerate(options)
+        )
+        return poll
+
+    def record_vote(self, user, positions):
+        """
+        Replace the user's choices with ``positions`` and return the updated tallies.
+
+        Each choice is its own PollVote row and tallies move with F()
+        expressions, so concurrent voters never overwrite each other.
+        """
+        options = {option.position: option for option in self.options.all()}
+        with transaction.atomic():
+            current = set(self.votes.filter(user=user).values_list('option__position', flat=True))
+            for position in current - positions:
+                deleted, _ = PollVote.objects.filter(option=options[position], user=user).delete()
+                if deleted:
+                    PollOption.objects.filter(pk=options[position].pk).update(vote_count=F('vote_count') - deleted)
+            for position in positions - current:
+                try:
+                    with transaction.atomic():
+                        PollVote.objects.create(poll=self, option=options[position], user=user)
+                except IntegrityError:
+                    continue  # Already recorded by a concurrent request
+                PollOption.objects.filter(pk=options[position].pk).update(vote_count=F('vote_count') + 1)
+        return self.tallies()
+
+    def tallies(self):
+        """Vote count per option, in option order"""
+        return list(self.options.values_list('vote_count', flat=True))
+
+    def __str__(self):
+        return f"Poll on message {self.message_id}: {self.question[:20]}"
+
+class PollOption(models.Model):
+    poll = models.ForeignKey(Poll, related_name='options', on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()  # Index used by clients when voting
+    text = models.TextField()
+    vote_count = models.PositiveIntegerField(default=0)  # Maintained by Poll.record_vote
+
+    class Meta:
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['poll', 'position'], name='unique_poll_option_position'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+class PollVote(models.Model):
+    """One user's choice of one poll option"""
+    poll = models.ForeignKey(Poll, related_name='votes', on_delete=models.CASCADE)
+    option = models.ForeignKey(PollOption, related_name='votes', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='poll_votes', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['option', 'user'], name='unique_poll_vote'),
+        ]
+        indexes = [
+            models.Index(fields=['poll', 'user']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} voted {self.option_id}"
+
+def message_preview(msg, length=100):
+    """Short text shown for a message in conversation lists"""
+    try:
+        return f"Poll: {msg.poll.question}"[:length]
+    except Poll.DoesNotExist:
+        pass
+    if msg.content:
+        return msg.content[:length]
+    if msg.imageUrl:
+        return "Photo"
+    if msg.documentUrl:
+        return (msg.documentName or "Document")[:length]
+    return ""
+
+class ConversationSummary(models.Model):
+    """Inbox row for one user's direct-message conversation with a partner, maintained on write"""
+    owner = models.ForeignKey(User, related_name='conversation_summaries', on_delete=models.CASCADE)
+    partner = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_preview = models.CharField(max_length=100, blank=True, default='')
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_id = models.BigIntegerField(default=0)  # Owner has read every message up to this id
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'partner'], name='unique_conversation_summary'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-last_timestamp'], name='summary_owner_recent_idx'),
+        ]
+
+    @classmethod
+    def record_message(cls, msg):
+        """Update both participants' rows for a newly sent direct message"""
+        preview = message_preview(msg)
+        fields = {'last_message': msg, 'last_preview': preview, 'last_timestamp': msg.timestamp}
+        # Replying means the sender has read the conversation
+        sides = [(msg.sender_id, msg.receiver_id, {'unread_count': 0, 'last_read_id': msg.id})]
+        if msg.receiver_id != msg.sender_id:
+            sides.append((msg.receiver_id, msg.sender_id, {'unread_count': F('unread_count') + 1}))
+        for owner_id, partner_id, counters in sides:
+            rows = cls.objects.filter(owner_id=owner_id, partner_id=partner_id)
+            if not rows.update(**counters, **fields):
+                # First message of the conversation: create the row, then apply the same update
+                cls.objects.get_or_create(owner_id=owner_id, partner_id=partner_id)
+                rows.update(**counters, **fields)
+
+    @classmethod
+    def refresh(cls, owner, partner):
+        """Recompute one row from the messages still visible to the owner, e.g. after a deletion or read"""
+        summary = cls.objects.filter(owner=owner, partner=partner).first()
+        if summary is None:
+            return None
+        visible = Message.objects.filter(conversation=conversation_key(owner.id, partner.id)).visible_to(owner)
+        last = visible.select_related('poll').order_by('-id').first()
+        summary.last_message = last
+        summary.last_preview = message_preview(last) if last else ''
+        summary.last_timestamp = last.timestamp if last else None
+        summary.unread_count = visible.filter(sender=partner, id__gt=summary.last_read_id).count()
+        summary.save(update_fields=['last_message', 'last_preview', 'last_timestamp', 'unread_count'])
+        return summary
+
+    @classmethod
+    def mark_read(cls, owner, partner, up_to_id):
+        """Move the owner's read position forward (never backwards) and recount unread messages"""
+        cls.objects.filter(owner=owner, partner=partner, last_read_id__lt=up_to_id).update(last_read_id=up_to_id)
+        return cls.refresh(owner, partner)
+
+    def __str__(self):
+        return f"{self.owner_id} with {self.partner_id}: {self.last_preview[:20]}"
+
+class GroupReadState(models.Model):
+    """How far a member has read a group's messages"""
+    user = models.ForeignKey(User, related_name='group_read_states', on_delete=models.CASCADE)
+    group = models.ForeignKey(Group, related_name='read_states', on_delete=models.CASCADE)
+    last_read_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group'], name='unique_group_read_state'),
+        ]
+
+    @classmethod
+    def mark_read(cls, user, group, up_to_id):
+        """Move the user's read position forward (never backwards)"""
+        state, created = cls.objects.get_or_create(user=user, group=group, defaults={'last_read_id': up_to_id})
+        if not created:
+            cls.objects.filter(pk=state.pk, last_read_id__lt=up_to_id).update(last_read_id=up_to_id)
+        return state
+
+    @classmethod
+    def start_reading(cls, group, user_ids):
+        """Put new members' read position at the group's newest message, so its history is not unread"""
+        latest = group.messages.order_by('-id').values_list('id', flat=True).first() or 0
+        cls.objects.bulk_create(
+            [cls(user_id=user_id, group=group, last_read_id=latest) for user_id in user_ids],
+            update_conflicts=True, unique_fields=['user', 'group'], update_fields=['last_read_id'],
+        )
+
+    def __str__(self):
+        return f"{self.user_id} read group {self.group_id} up to {self.last_read_id}"
+
+@receiver(m2m_changed, sender=Group.members.through)
+def start_group_read_states(sender, instance, action, reverse, pk_set, **kwargs):
+    # Covers group creation (members.set) and add_group_member alike
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        for group in Group.objects.filter(pk__in=pk_set):
+            GroupReadState.start_reading(group, [instance.pk])
+    else:
+        GroupReadState.start_reading(instance, pk_set)
+
+class Upload(models.Model):
+    """A stored upload, addressed by the SHA-256 of its content (see chat.uploads)"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    original_name = models.CharField(max_length=255, blank=True, default='')  # Name of the first upload
+    upload_count = models.PositiveIntegerField(default=1)  # Times this content was uploaded
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Filled in the background for images (see chat.thumbnails)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=dict, blank=True)  # size name -> {path, width, height}
+    placeholder = models.TextField(blank=True, default='')  # Storage path of a tiny blurred preview
+
+    def __str__(self):
+        return f"{self.original_name or self.file.name} ({self.sha256[:12]})"
+
+class ChangeEvent(models.Model):
+    """An event published to the change feed, stored once however many recipients it has"""
+    kind = models.CharField(max_length=40)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} at {self.created_at}"
+
+class Change(models.Model):
+    """
+    Append-only per-user change feed (see events.publish): one row per
+    recipient, pointing at the shared ChangeEvent.
+
+    The auto-increment id doubles as the global sequence number that
+    clients sync from, so it must never be reused.
+    """
+    user = models.ForeignKey(User, related_name='changes', on_delete=models.CASCADE)  # Recipient
+    event = models.ForeignKey(ChangeEvent, related_name='deliveries', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_user_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} event {self.event_id} for {self.user_id}"
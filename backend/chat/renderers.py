@@ -0,0 +1,79 @@
+"""
+orjson-backed drop-in replacements for DRF's JSONRenderer and JSONParser.
+
+Output matches ``rest_framework.renderers.JSONRenderer`` with the default
+settings (compact separators, raw UTF-8, U+2028/U+2029 escaped, datetimes
+formatted by DRF's encoder). Requests the fast path cannot handle the same
+way -- indented output, ``UNICODE_JSON``/``COMPACT_JSON`` turned off, or
+values orjson rejects such as integers wider than 64 bits -- fall back to
+the stock implementation, as does everything when orjson is not installed.
+Floats are the one cosmetic difference: orjson prints e.g. ``1e16`` where
+the stdlib prints ``1e+16``; both parse to the same value.
+"""
+import re
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser, get_encoding
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders, json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson reads integers wider than 64 bits as floats; bodies that might hold one go to the stdlib
+LONG_DIGIT_RUN_RE = re.compile(rb'\d{19}')
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Renderer which serializes to JSON with orjson"""
+    if orjson is not None:
+        options = (
+            orjson.OPT_PASSTHROUGH_DATETIME  # keep DRF's datetime format ('Z' suffix, no ms trimming)
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_NON_STR_KEYS
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=encoders.JSONEncoder().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same strict-javascript-subset escaping as JSONRenderer
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
+
+
+class ORJSONParser(JSONParser):
+    """Parses JSON-serialized data with orjson"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = get_encoding(parser_context)
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if not LONG_DIGIT_RUN_RE.search(body):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        # orjson is stricter than the stdlib in places (e.g. lone surrogates);
+        # let json decide so accepted input and error messages stay the same
+        try:
+            parse_constant = json.strict_constant if self.strict else None
+            return json.loads(body.decode(encoding), parse_constant=parse_constant)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,95 @@
+"""
+Read/write splitting for the polling endpoints.
+
+When a ``replica`` database is configured, views wrapped in
+``read_from_replica`` run their reads (ETag checks included) against it,
+and everything else, every write, and any read inside a transaction goes to
+the primary. A request only uses the replica once it holds the newest entry
+of the requesting user's change feed (see chat.events): every write a user
+makes or should see lands there, so nobody reads a state older than what
+they have already been sent, however far the replica lags. The check is two
+primary-key lookups and does not depend on how often the replica syncs.
+
+The replica can be any second database holding the same data: a local
+SQLite copy refreshed by ``manage.py sync_replica``, or a real replica.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = ContextVar('chat_replica_reads', default=False)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in connections
+
+
+def replica_has_changes_of(user):
+    """Whether the replica already holds the newest change feed entry of ``user``"""
+    from .models import Change
+    latest = Change.objects.using(DEFAULT_DB_ALIAS).filter(user=user).order_by('-id').values_list('id', flat=True).first()
+    return latest is None or Change.objects.using(REPLICA_DB_ALIAS).filter(pk=latest).exists()
+
+
+def request_user(request, username_param, kwargs):
+    """The user a polling request is for: the session user, else the one named by ``username_param``"""
+    from .usercache import get_user
+    if request.user.is_authenticated:
+        return request.user
+    try:
+        return get_user(kwargs.get(username_param) or request.GET.get(username_param))
+    except get_user_model().DoesNotExist:
+        return None
+
+
+def read_from_replica(username_param='username'):
+    """
+    Serve the view's safe requests from the replica, unless it has not yet
+    caught up with the change feed of the requesting user
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in SAFE_METHODS or not replica_configured()
+                    or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+                return view(request, *args, **kwargs)
+            user = request_user(request, username_param, kwargs)
+            if user is not None and not replica_has_changes_of(user):
+                return view(request, *args, **kwargs)
+            token = _replica_reads.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+        return wrapper
+    return decorator
+
+
+class PrimaryReplicaRouter:
+    """Send reads marked by ``read_from_replica`` to the replica and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if not replica_configured():
+            return None
+        if _replica_reads.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_DB_ALIAS
+        # Explicit, so related lookups on replica-loaded objects do not stay on the replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if replica_configured() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives schema and data from the primary
+        return False if db == REPLICA_DB_ALIAS else None
+
@@ -0,0 +1,170 @@
+"""
+Full-text message search.
+
+On SQLite, message text is indexed in ``chat_message_fts``, a contentless
+FTS5 table keyed by message id. Triggers keep it in sync for every write
+path (ORM saves, bulk inserts, raw SQL): new messages are indexed, edits
+re-indexed, and messages deleted for everyone are dropped. Poll messages
+store JSON; only their question and option text is indexed, not the keys.
+Schema changes that make Django rebuild ``chat_message`` drop those
+triggers, so ``restore_search_triggers`` recreates them after every migrate.
+
+Other databases fall back to a ``content__icontains`` scan ordered by
+recency.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Group, Message, conversation_key
+
+FTS_TABLE = 'chat_message_fts'
+# bm25 weight is divided by (1 + age / RECENCY_DAYS): a match this many days old counts half
+RECENCY_DAYS = 30
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Only rows that are visible to someone are indexed
+INDEXED = "{row}.deleted_for_everyone = 0 AND {row}.content != ''"
+# The text indexed for a row: the question and options of a poll, the content of anything else.
+# Nested CASEs because SQLite only guarantees CASE branches are evaluated lazily, and
+# json_extract raises on malformed JSON. Deletes must pass the same text that was indexed.
+SEARCH_TEXT = """CASE WHEN json_valid({row}.content) THEN
+    CASE WHEN json_extract({row}.content, '$.type') = 'poll' THEN
+        coalesce(json_extract({row}.content, '$.question'), '') || ' ' || coalesce((
+            SELECT group_concat(value, ' ') FROM json_each({row}.content, '$.options') WHERE type = 'text'
+        ), '')
+    ELSE {row}.content END
+ELSE {row}.content END"""
+
+# Also inlined in migration 0026, which must not change when this module does
+SEARCH_INDEX_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON chat_message
+        WHEN {INDEXED.format(row='new')} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, {SEARCH_TEXT.format(row='new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON chat_message
+        WHEN {INDEXED.format(row='old')} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, {SEARCH_TEXT.format(row='old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content, deleted_for_everyone ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content)
+            SELECT 'delete', old.id, {SEARCH_TEXT.format(row='old')} WHERE {INDEXED.format(row='old')};
+        INSERT INTO {FTS_TABLE}(rowid, content)
+            SELECT new.id, {SEARCH_TEXT.format(row='new')} WHERE {INDEXED.format(row='new')};
+    END""",
+]
+
+
+def install_search_index(using_connection, populate=False):
+    """Create the FTS table and triggers if missing; ``populate`` indexes existing messages"""
+    if using_connection.vendor != 'sqlite':
+        return
+    with using_connection.cursor() as cursor:
+        for statement in SEARCH_INDEX_SQL:
+            cursor.execute(statement)
+        if populate:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, content) SELECT id, {SEARCH_TEXT.format(row='chat_message')} FROM chat_message "
+                f"WHERE {INDEXED.format(row='chat_message')}"
+            )
+
+
+def restore_search_triggers(using_connection):
+    """Recreate the triggers if the index exists; run after migrate, which may have rebuilt chat_message"""
+    if using_connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE in using_connection.introspection.table_names():
+        install_search_index(using_connection)
+
+
+def drop_search_index(using_connection):
+    if using_connection.vendor != 'sqlite':
+        return
+    with using_connection.cursor() as cursor:
+        for suffix in ('insert', 'delete', 'update'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def fts_query(text):
+    """
+    Turn free text into a safe FTS5 query: every word must match, the last
+    one as a prefix so results appear while typing. Returns '' when the
+    text has no searchable words.
+    """
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_messages(user, text, limit, offset=0, partner=None, group=None):
+    """
+    Messages visible to ``user`` that match ``text``, best first, as
+    ``(messages, has_more)``.
+
+    Visible means: a DM the user sent or received, or a message in a group
+    the user belongs to; not deleted for everyone and not deleted by the
+    user. ``partner`` or ``group`` narrow the search to one conversation.
+    """
+    query = fts_query(text)
+    if not query:
+        return [], False
+
+    if connection.vendor != 'sqlite':
+        return search_messages_fallback(user, text, limit, offset, partner, group)
+
+    if group is not None:
+        scope, scope_params = "m.group_id = %s AND EXISTS (SELECT 1 FROM chat_group_members gm WHERE gm.group_id = m.group_id AND gm.user_id = %s)", [group.id, user.id]
+    elif partner is not None:
+        scope, scope_params = "m.conversation = %s", [conversation_key(user.id, partner.id)]
+    else:
+        scope = ("(m.group_id IS NULL AND (m.sender_id = %s OR m.receiver_id = %s) "
+                 "OR m.group_id IN (SELECT gm.group_id FROM chat_group_members gm WHERE gm.user_id = %s))")
+        scope_params = [user.id, user.id, user.id]
+
+    sql = f"""
+        SELECT m.id, bm25({FTS_TABLE}) / (1 + (julianday('now') - julianday(m.timestamp)) / %s) AS score
+        FROM {FTS_TABLE}
+        JOIN chat_message m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s
+          AND m.deleted_for_everyone = 0
+          AND {scope}
+          AND NOT EXISTS (SELECT 1 FROM chat_messagedeletion d WHERE d.message_id = m.id AND d.user_id = %s)
+        ORDER BY score, m.id DESC
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [RECENCY_DAYS, query, *scope_params, user.id, limit + 1, offset])
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    ranked_ids = [message_id for message_id, _ in rows[:limit]]
+    messages = Message.objects.filter(id__in=ranked_ids).with_related().in_bulk()
+    return [messages[message_id] for message_id in ranked_ids if message_id in messages], has_more
+
+
+def search_messages_fallback(user, text, limit, offset, partner, group):
+    """Substring scan for databases without FTS5; newest first"""
+    messages = Message.objects.visible_to(user)
+    if group is not None:
+        messages = messages.filter(group=group, group__members=user)
+    elif partner is not None:
+        messages = messages.filter(conversation=conversation_key(user.id, partner.id))
+    else:
+        messages = messages.filter(
+            Q(group__isnull=True, sender=user) | Q(group__isnull=True, receiver=user)
+            | Q(group__in=Group.objects.filter(members=user))
+        )
+    for token in TOKEN_RE.findall(text):
+        messages = messages.filter(content__icontains=token)
+    page = list(messages.with_related().order_by('-id')[offset:offset + limit + 1])
+    return page[:limit], len(page) > limit
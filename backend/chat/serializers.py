@@ -1,6 +1,13 @@
+import logging
+from urllib.parse import urlsplit
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Message, Profile, Group
+from .models import ConversationSummary, Message, Profile, Group, Poll
+from .usercache import REF_FIELDS
+
+logger = logging.getLogger(__name__)
 
 class ProfileSerializer(serializers.ModelSerializer):
     friends = serializers.SerializerMethodField()
@@ -11,8 +18,8 @@ class ProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'friends']  # Make user and friends read-only for updates
     
     def get_friends(self, obj):
-        # Return list of friend IDs from the JSONField
-        return obj.friends if obj.friends else []
+        # Friend user IDs; list views prefetch 'friendships' to keep this query-free
+        return [friendship.friend_id for friendship in obj.user.friendships.all()]
     
     def to_representation(self, instance):
         # Handle case where profile might not exist
@@ -30,41 +37,56 @@ class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(required=False)
     class Meta:
         model = User
-        fields = ['id', 'username', 'first_name', 'last_name', 'profile']
+        # Only the fields chat.usercache loads: users from get_user have every other field
+        # deferred, and reading one would cost a query per user serialized
+        fields = [*REF_FIELDS, 'profile']
         read_only_fields = ['id', 'username']  # Make id and username read-only for updates
 
     def update(self, instance, validated_data):
         try:
-            print(f"UserSerializer.update called with data: {validated_data}")
             profile_data = validated_data.pop('profile', None)
-            print(f"Profile data: {profile_data}")
+            logger.debug("Updating user", extra={'user_id': instance.id, 'fields': sorted(validated_data), 'profile_fields': sorted(profile_data or ())})
             
             user = super().update(instance, validated_data)
-            print(f"User updated: {user}")
             
             if profile_data:
                 try:
                     profile, created = Profile.objects.get_or_create(user=user)
-                    print(f"Profile {'created' if created else 'retrieved'}: {profile}")
                     # Update profile fields
                     for attr, value in profile_data.items():
                         if hasattr(profile, attr) and attr not in ['user', 'friends']:
                             setattr(profile, attr, value)
-                            print(f"Set {attr} = {value}")
                     profile.save()
-                    print(f"Profile saved successfully: {profile}")
                     instance.refresh_from_db()
-                except Exception as profile_error:
-                    print(f"Error updating profile: {profile_error}")
-                    import traceback
-                    traceback.print_exc()
+                except Exception:
+                    logger.exception("Error updating profile", extra={'user_id': user.id})
             return instance
-        except Exception as e:
-            print(f"Error in UserSerializer.update: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error in UserSerializer.update", extra={'user_id': instance.id})
             raise
 
+class UserRefSerializer(serializers.ModelSerializer):
+    """Lightweight user reference used inside message payloads (no profile or friends)"""
+    display_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'display_name']
+
+    def get_display_name(self, obj):
+        return obj.get_full_name() or obj.username
+
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    """A chat partner (same fields as UserSerializer) plus the inbox fields of the conversation"""
+    class Meta:
+        model = ConversationSummary
+        fields = ['last_message', 'last_preview', 'last_timestamp', 'unread_count']
+
+    def to_representation(self, instance):
+        data = UserSerializer(instance.partner).data
+        data.update(super().to_representation(instance))
+        return data
+
 class GroupSerializer(serializers.ModelSerializer):
     members = UserSerializer(many=True, read_only=True)
     member_ids = serializers.PrimaryKeyRelatedField(
@@ -75,25 +97,79 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ['id', 'name', 'members', 'member_ids']
 
+class GroupSummarySerializer(serializers.ModelSerializer):
+    """Group list entry: member count and a short member preview instead of every member"""
+    member_count = serializers.IntegerField(read_only=True)
+    members_preview = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'member_count', 'members_preview']
+
+    def get_members_preview(self, obj):
+        # Attached by the view from a single windowed query over all listed groups
+        return UserRefSerializer(getattr(obj, 'members_preview', []), many=True).data
+
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
-    receiver = UserSerializer(read_only=True)
+    sender = UserRefSerializer(read_only=True)
+    receiver = UserRefSerializer(read_only=True)
     poll = serializers.SerializerMethodField()
+    pollVotes = serializers.SerializerMethodField()
+    pollTallies = serializers.SerializerMethodField()
+    imageVariants = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'receiver', 'content', 'imageUrl', 'documentUrl', 'documentName', 'timestamp', 'poll', 'pollVotes']
+        fields = ['id', 'sender', 'receiver', 'content', 'imageUrl', 'imageVariants', 'documentUrl', 'documentName', 'timestamp', 'poll', 'pollVotes', 'pollTallies']
 
-    def get_poll(self, obj):
-        import json
+    def _poll(self, obj):
         try:
-            data = json.loads(obj.content)
-            if isinstance(data, dict) and data.get('type') == 'poll':
-                return {
-                    'question': data.get('question'),
-                    'options': data.get('options'),
-                    'allowMultiple': data.get('allowMultiple', False)
-                }
-        except Exception:
-            pass
-        return None
+            return obj.poll
+        except Poll.DoesNotExist:
+            return None
+
+    def get_poll(self, obj):
+        poll = self._poll(obj)
+        if poll is None:
+            return None
+        return {
+            'question': poll.question,
+            'options': [option.text for option in poll.options.all()],
+            'allowMultiple': poll.allow_multiple
+        }
+
+    def get_pollVotes(self, obj):
+        # {voter_username: [option_idx, ...]}, kept for clients that render from individual votes
+        poll = self._poll(obj)
+        votes = {}
+        if poll is not None:
+            for vote in poll.votes.all():
+                votes.setdefault(vote.user.username, []).append(vote.option.position)
+        return votes
+
+    def get_pollTallies(self, obj):
+        poll = self._poll(obj)
+        if poll is None:
+            return None
+        return [option.vote_count for option in poll.options.all()]
+
+    def get_imageVariants(self, obj):
+        """Resized copies and a blur placeholder of the image, once generated (None until then)"""
+        upload = obj.image_upload if obj.image_upload_id else None
+        if upload is None or not upload.placeholder:
+            return None
+        # Variant URLs share the scheme and host of the original imageUrl
+        origin = urlsplit(obj.imageUrl or '')
+        base = f"{origin.scheme}://{origin.netloc}" if origin.netloc else ''
+        placeholder = upload.placeholder
+        if not placeholder.startswith('data:'):  # Uploads processed before placeholders became files
+            placeholder = base + default_storage.url(placeholder)
+        return {
+            'width': upload.width,
+            'height': upload.height,
+            'placeholder': placeholder,
+            'sizes': {
+                name: {'url': base + default_storage.url(variant['path']), 'width': variant['width'], 'height': variant['height']}
+                for name, variant in upload.variants.items()
+            },
+        }
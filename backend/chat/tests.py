@@ -1,3 +1,707 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import usercache
+from .models import Change, ChangeEvent, ConversationSummary, Group, Message, MessageDeletion, Upload
+from .routers import REPLICA_DB_ALIAS, replica_has_changes_of
+from .search import FTS_TABLE, restore_search_triggers, search_messages_fallback
+from .uploads import INCOMING_DIR
+from .views import MAX_MESSAGE_PAGE_SIZE, SYNC_SAFETY_MARGIN, group_unread_counts
+
+
+# A mirror of the test database standing in for a replica; only tests that list it in
+# ``databases`` may query it, and reads inside a transaction never reach it
+connections.settings.setdefault(REPLICA_DB_ALIAS, {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}})
+
+
+class ChatTestCase(TestCase):
+    """Creates alice and bob; the username cache is reset so ids never leak between tests"""
+
+    def setUp(self):
+        usercache._backend = None
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+
+    def send(self, sender, receiver, content='hi', **extra):
+        response = self.client.post('/api/chat/send/', {
+            'sender': sender.username, 'receiver': receiver.username, 'content': content, **extra,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['message']
+
+    def send_poll(self, options=('Pizza', 'Sushi'), allow_multiple=False):
+        message = self.send(self.alice, self.bob, content='', type='poll', poll={
+            'question': 'Lunch?', 'options': list(options), 'allowMultiple': allow_multiple,
+        })
+        return Message.objects.get(pk=message['id'])
+
+    def send_to_group(self, sender, group, content='hi'):
+        response = self.client.post('/api/chat/group_messages/', {
+            'sender': sender.username, 'group_id': group.id, 'content': content,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def create_group(self, *members):
+        response = self.client.post('/api/chat/groups/', {
+            'name': 'lunch', 'member_ids': [member.id for member in members],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Group.objects.get(pk=response.json()['id'])
+
+    def unread(self, user):
+        return self.client.get('/api/chat/unread/', {'username': user.username}).json()
+
+    def mark_read(self, user, up_to_id, **target):
+        response = self.client.post('/api/chat/read/', {
+            'username': user.username, 'up_to_id': up_to_id, **target,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['unread_count']
+
+    def vote(self, msg, voter, selected):
+        return self.client.post('/api/chat/poll/vote/', {
+            'message_id': msg.id, 'voter': voter.username, 'selected': selected,
+        }, content_type='application/json')
+
+
+class PollVoteTests(ChatTestCase):
+    def test_votes_are_tallied_per_option(self):
+        msg = self.send_poll()
+        self.assertEqual(self.vote(msg, self.alice, 0).json()['tallies'], [1, 0])
+        response = self.vote(msg, self.bob, 1)
+        self.assertEqual(response.json()['tallies'], [1, 1])
+        self.assertEqual(response.json()['totalVotes'], 2)
+
+    def test_changing_a_vote_moves_it(self):
+        msg = self.send_poll()
+        self.vote(msg, self.alice, 0)
+        self.assertEqual(self.vote(msg, self.alice, 1).json()['tallies'], [0, 1])
+        self.assertEqual(msg.poll.tallies(), [0, 1])
+
+    def test_repeating_a_vote_counts_once(self):
+        msg = self.send_poll()
+        self.vote(msg, self.alice, 0)
+        self.assertEqual(self.vote(msg, self.alice, 0).json()['tallies'], [1, 0])
+
+    def test_multiple_choice(self):
+        msg = self.send_poll(options=('A', 'B', 'C'), allow_multiple=True)
+        self.assertEqual(self.vote(msg, self.alice, [0, 2]).json()['tallies'], [1, 0, 1])
+        self.assertEqual(self.vote(msg, self.alice, [2]).json()['tallies'], [0, 0, 1])
+
+    def test_invalid_votes_are_rejected(self):
+        msg = self.send_poll()
+        self.assertEqual(self.vote(msg, self.alice, [0, 1]).status_code, 400)
+        self.assertEqual(self.vote(msg, self.alice, 5).status_code, 400)
+        with self.assertLogs('chat.views', 'INFO'):
+            self.assertEqual(self.vote(msg, self.alice, 'x').status_code, 400)
+        self.assertEqual(msg.poll.tallies(), [0, 0])
+
+    def test_message_list_shows_tallies(self):
+        msg = self.send_poll()
+        self.vote(msg, self.bob, 1)
+        messages = self.client.get('/api/chat/messages/user1=alice&user2=bob/').json()
+        self.assertEqual(messages[-1]['pollTallies'], [0, 1])
+        self.assertEqual(messages[-1]['pollVotes'], {'bob': [1]})
+
+
+class UnreadCountTests(ChatTestCase):
+    def test_direct_messages(self):
+        first = self.send(self.alice, self.bob)
+        last = self.send(self.alice, self.bob)
+        self.assertEqual(self.unread(self.bob)['direct'], {'alice': 2})
+        self.assertEqual(self.unread(self.alice)['direct'], {})
+
+        self.assertEqual(self.mark_read(self.bob, first['id'], partner='alice'), 1)
+        self.assertEqual(self.mark_read(self.bob, last['id'], partner='alice'), 0)
+        # Read positions never move backwards
+        self.assertEqual(self.mark_read(self.bob, first['id'], partner='alice'), 0)
+        self.assertEqual(self.unread(self.bob)['direct'], {})
+
+    def test_groups(self):
+        carol = User.objects.create_user('carol', password='pw')
+        group = self.create_group(self.alice, self.bob)
+        self.assertEqual(self.unread(self.bob)['groups'], {str(group.id): 0})
+
+        self.send_to_group(self.alice, group)
+        last = self.send_to_group(self.alice, group)
+        self.assertEqual(self.unread(self.bob)['groups'], {str(group.id): 2})
+        self.assertEqual(self.unread(self.alice)['groups'], {str(group.id): 0})
+
+        # New members start with everything so far read
+        self.client.post(f'/api/chat/groups/{group.id}/add_member/', {'username': 'carol'}, content_type='application/json')
+        self.assertEqual(group_unread_counts(carol), {group.id: 0})
+
+        self.assertEqual(self.mark_read(self.bob, last['id'], group_id=group.id), 0)
+        self.send_to_group(self.alice, group)
+        self.assertEqual(group_unread_counts(self.bob), {group.id: 1})
+
+    def test_messages_deleted_for_the_reader_are_not_unread(self):
+        group = self.create_group(self.alice, self.bob)
+        message = self.send_to_group(self.alice, group)
+        self.client.delete(f"/api/chat/messages/{message['id']}/?type=for_me&username=bob")
+        self.assertEqual(group_unread_counts(self.bob), {group.id: 0})
+
+
+class ETagTests(ChatTestCase):
+    """Polling endpoints answer 304 until a write changes what they would return"""
+
+    def assertWriteChangesETag(self, url, write):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        write()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_new_chats(self):
+        url = '/api/chat/check-new-chats/?username=bob'
+        message = {}
+        self.assertWriteChangesETag(url, lambda: message.update(self.send(self.alice, self.bob)))
+        self.assertWriteChangesETag(url, lambda: self.mark_read(self.bob, message['id'], partner='alice'))
+        self.assertWriteChangesETag(url, lambda: self.client.delete(f"/api/chat/messages/{message['id']}/?type=for_me&username=bob"))
+
+    def test_new_chats_after_the_partner_reads(self):
+        message = self.send(self.alice, self.bob)
+        self.assertWriteChangesETag(
+            '/api/chat/check-new-chats/?username=alice', lambda: self.mark_read(self.bob, message['id'], partner='alice'),
+        )
+
+    def test_messages(self):
+        url = '/api/chat/messages/user1=bob&user2=alice/'
+        msg = self.send_poll()
+        self.assertWriteChangesETag(url, lambda: self.send(self.bob, self.alice))
+        self.assertWriteChangesETag(url, lambda: self.vote(msg, self.alice, 0))
+        self.assertWriteChangesETag(url, lambda: self.client.delete(f'/api/chat/messages/{msg.id}/?type=for_everyone&username=alice'))
+
+    def test_group_messages(self):
+        carol = User.objects.create_user('carol', password='pw')
+        group = self.create_group(self.alice, self.bob)
+        url = f'/api/chat/group_messages/?group_id={group.id}&username=bob'
+        message = {}
+        self.assertWriteChangesETag(url, lambda: message.update(self.send_to_group(self.alice, group)))
+        self.assertWriteChangesETag(url, lambda: self.mark_read(self.bob, message['id'], group_id=group.id))
+        self.assertWriteChangesETag(url, lambda: self.client.post(
+            f'/api/chat/groups/{group.id}/add_member/', {'username': carol.username}, content_type='application/json',
+        ))
+
+    def test_group_messages_after_removal(self):
+        group = self.create_group(self.alice, self.bob)
+        url = f'/api/chat/group_messages/?group_id={group.id}&username=bob'
+        etag = self.client.get(url)['ETag']
+        self.client.post(f'/api/chat/groups/{group.id}/remove_member/', {'username': 'bob'}, content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_groups(self):
+        url = '/api/chat/groups/?username=bob'
+        self.assertWriteChangesETag(url, lambda: self.create_group(self.alice, self.bob))
+        self.assertWriteChangesETag(url, lambda: self.client.patch(
+            f'/api/chat/users/{self.bob.id}/', {'first_name': 'Bob'}, content_type='application/json',
+        ))
+
+    def test_users_unchanged_by_login(self):
+        response = self.client.get('/api/chat/users/')
+        self.assertTrue(self.client.login(username='bob', password='pw'))
+        self.assertEqual(self.client.get('/api/chat/users/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertWriteChangesETag('/api/chat/users/', lambda: self.client.patch(
+            f'/api/chat/users/{self.bob.id}/', {'first_name': 'Bob'}, content_type='application/json',
+        ))
+
+    def test_friends(self):
+        self.client.force_login(self.alice)
+        self.assertWriteChangesETag('/api/chat/friends/', lambda: self.client.post(f'/api/chat/users/{self.bob.id}/add_friend/'))
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, MAX_UPLOAD_SIZE=1024)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def upload(self, content, name='notes.txt'):
+        return self.client.post('/api/chat/upload/', {'file': SimpleUploadedFile(name, content, 'text/plain')})
+
+    def test_identical_content_is_stored_once(self):
+        first = self.upload(b'same bytes', 'a.txt').json()
+        second = self.upload(b'same bytes', 'b.txt').json()
+        self.assertFalse(first['deduplicated'])
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(first['url'], second['url'])
+        self.assertEqual(first['sha256'], second['sha256'])
+
+        upload = Upload.objects.get()
+        self.assertEqual(upload.upload_count, 2)
+        self.assertEqual(upload.original_name, 'a.txt')
+        with open(upload.file.path, 'rb') as stored:
+            self.assertEqual(stored.read(), b'same bytes')
+        self.assertEqual(os.listdir(os.path.join(self.media_root, INCOMING_DIR)), [])
+
+    def test_different_content_is_stored_separately(self):
+        first = self.upload(b'one').json()
+        second = self.upload(b'two').json()
+        self.assertNotEqual(first['url'], second['url'])
+        self.assertEqual(Upload.objects.count(), 2)
+
+    def test_size_limit(self):
+        self.assertEqual(self.upload(b'x' * 1024).status_code, 200)
+        response = self.upload(b'y' * 1025)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Upload.objects.count(), 1)
+
+    def test_missing_file(self):
+        self.assertEqual(self.client.post('/api/chat/upload/', {}).status_code, 400)
+
+
+class ChangeFeedTests(ChatTestCase):
+    def sync(self, user, since=0):
+        response = self.client.get('/api/chat/sync/', {'username': user.username, 'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def age_changes(self, days=30):
+        Change.objects.update(created_at=timezone.now() - timedelta(days=days))
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(days=days))
+
+    def test_changes_after_since(self):
+        first = self.send(self.alice, self.bob, 'one')
+        second = self.send(self.alice, self.bob, 'two')
+        feed = self.sync(self.bob)
+        self.assertEqual([change['type'] for change in feed['changes']], ['message.new', 'message.new'])
+        self.assertEqual([change['data']['message']['id'] for change in feed['changes']], [first['id'], second['id']])
+        self.assertTrue(all(change['created_at'] for change in feed['changes']))
+        self.assertEqual(feed['seq'], feed['changes'][-1]['seq'])
+        self.assertFalse(feed['has_more'])
+        self.assertFalse(feed['reset'])
+
+        self.assertEqual(self.sync(self.bob, feed['seq']), {'changes': [], 'seq': feed['seq'], 'has_more': False, 'reset': False})
+
+    def test_events_are_stored_once_per_write(self):
+        group = self.create_group(self.alice, self.bob)
+        self.send_to_group(self.alice, group)
+        event = ChangeEvent.objects.get(kind='message.new')
+        self.assertEqual(set(event.deliveries.values_list('user__username', flat=True)), {'alice', 'bob'})
+
+    @mock.patch('chat.views.CHANGE_PAGE_SIZE', 2)
+    def test_paging(self):
+        for content in ('one', 'two', 'three'):
+            self.send(self.alice, self.bob, content)
+        page = self.sync(self.bob)
+        self.assertEqual(len(page['changes']), 2)
+        self.assertTrue(page['has_more'])
+        page = self.sync(self.bob, page['seq'])
+        self.assertEqual([change['data']['message']['content'] for change in page['changes']], ['three'])
+        self.assertFalse(page['has_more'])
+
+    def test_reset_after_compaction(self):
+        self.send(self.alice, self.bob, 'one')
+        seen = self.sync(self.bob)['seq']
+        self.send(self.alice, self.bob, 'two')
+        self.age_changes()
+        self.send(self.alice, self.bob, 'three')
+        call_command('compact_changes', days=7, stdout=io.StringIO())
+        self.assertFalse(ChangeEvent.objects.filter(data__message__content='two').exists())
+
+        feed = self.sync(self.bob, seen)
+        self.assertTrue(feed['reset'])
+        self.assertEqual(feed['changes'], [])
+        self.assertFalse(self.sync(self.bob, feed['seq'])['reset'])
+
+    def test_first_sync_after_compaction(self):
+        self.send(self.alice, self.bob, 'one')
+        self.age_changes()
+        self.send(self.alice, self.bob, 'two')
+        call_command('compact_changes', days=7, stdout=io.StringIO())
+
+        feed = self.sync(self.bob)
+        self.assertFalse(feed['reset'])
+        self.assertEqual([change['data']['message']['content'] for change in feed['changes']], ['two'])
+
+
+class LongPollTests(ChatTestCase):
+    def long_poll(self, user, since, timeout=5):
+        return self.async_client.get('/api/chat/long-poll/', {'username': user.username, 'since': since, 'timeout': timeout})
+
+    def send_and_publish(self, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.send(*args)
+
+    async def test_pending_changes_are_returned_at_once(self):
+        await sync_to_async(self.send)(self.alice, self.bob)
+        sync = await self.async_client.get('/api/chat/sync/', {'username': 'bob'})
+        response = await self.long_poll(self.bob, 0)
+        self.assertEqual(response.json(), sync.json())
+
+    async def test_woken_response_matches_sync(self):
+        async def send_later():
+            await asyncio.sleep(0.2)
+            await sync_to_async(self.send_and_publish)(self.alice, self.bob)
+
+        response, _ = await asyncio.gather(self.long_poll(self.bob, 0), send_later())
+        feed = response.json()
+        self.assertEqual([change['type'] for change in feed['changes']], ['message.new'])
+        sync = await self.async_client.get('/api/chat/sync/', {'username': 'bob'})
+        self.assertEqual(feed, sync.json())
+
+    async def test_timeout(self):
+        response = await self.long_poll(self.bob, 0, timeout=0.1)
+        self.assertEqual(response.json(), {'changes': [], 'seq': 0, 'has_more': False, 'reset': False})
+
+
+class UserCacheTests(ChatTestCase):
+    def test_send_does_not_load_users(self):
+        self.send(self.alice, self.bob, 'warm the cache')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send(self.alice, self.bob)
+        self.assertEqual(response['sender']['username'], 'alice')
+        user_queries = [query['sql'] for query in queries if 'FROM "auth_user"' in query['sql']]
+        self.assertEqual(user_queries, [])
+        self.assertLessEqual(len(queries), 14)
+
+    def test_cached_users_have_the_serialized_fields(self):
+        user = usercache.get_user('alice')
+        self.assertEqual(user.get_deferred_fields() & set(usercache.REF_FIELDS), set())
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(usercache.get_user('alice').first_name, '')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.first_name = 'Alice'
+            self.alice.save()
+        self.assertEqual(usercache.get_user('alice').first_name, 'Alice')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.username = 'alicia'
+            self.alice.save()
+        with self.assertRaises(User.DoesNotExist):
+            usercache.get_user('alice')
+        self.assertEqual(usercache.get_user('alicia').pk, self.alice.pk)
+
+    def test_invalidated_on_delete(self):
+        usercache.get_user('bob')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.delete()
+        with self.assertRaises(User.DoesNotExist):
+            usercache.get_user('bob')
+
+
+class MessageSyncTests(ChatTestCase):
+    url = '/api/chat/messages/user1=bob&user2=alice/'
+
+    def poll(self, after_id, since=None, url=None, **params):
+        params.update({'after_id': after_id, **({'since': since} if since else {})})
+        response = self.client.get(url or self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def delete(self, message, user, delete_type):
+        response = self.client.delete(f"/api/chat/messages/{message['id']}/?type={delete_type}&username={user.username}")
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_only_newer_messages(self):
+        first = self.send(self.alice, self.bob, 'one')
+        self.send(self.bob, self.alice, 'two')
+        last = self.send(self.alice, self.bob, 'three')
+        page = self.poll(first['id'])
+        self.assertEqual([message['content'] for message in page['messages']], ['two', 'three'])
+        self.assertEqual(page['last_id'], last['id'])
+
+        page = self.poll(last['id'])
+        self.assertEqual(page['messages'], [])
+        self.assertEqual(page['last_id'], last['id'])
+
+    def test_server_time_lags_by_the_safety_margin(self):
+        before = timezone.now()
+        server_time = parse_datetime(self.poll(0)['server_time'])
+        self.assertLessEqual(server_time, before - SYNC_SAFETY_MARGIN + timedelta(seconds=5))
+        self.assertGreaterEqual(server_time, before - SYNC_SAFETY_MARGIN)
+
+    def test_deleted_ids(self):
+        for_everyone = self.send(self.alice, self.bob, 'one')
+        for_bob = self.send(self.alice, self.bob, 'two')
+        page = self.poll(0)
+        self.delete(for_everyone, self.alice, 'for_everyone')
+        self.delete(for_bob, self.bob, 'for_me')
+
+        page = self.poll(page['last_id'], page['server_time'])
+        self.assertEqual(sorted(page['deleted']), [for_everyone['id'], for_bob['id']])
+        self.assertEqual(page['messages'], [])
+        alice_page = self.poll(page['last_id'], page['server_time'], url='/api/chat/messages/user1=alice&user2=bob/')
+        self.assertEqual(alice_page['deleted'], [for_everyone['id']])
+        # Deletions inside the safety margin are reported again rather than risk missing one
+        self.assertEqual(sorted(self.poll(page['last_id'], page['server_time'])['deleted']), sorted(page['deleted']))
+
+    def test_deletion_committed_after_the_previous_poll(self):
+        message = self.send(self.alice, self.bob)
+        page = self.poll(0)
+        # Stamped before that poll ran but committed after it, as a slow delete would be
+        MessageDeletion.objects.create(message_id=message['id'], user=self.bob)
+        MessageDeletion.objects.update(deleted_at=timezone.now() - SYNC_SAFETY_MARGIN / 2)
+        self.assertEqual(self.poll(page['last_id'], page['server_time'])['deleted'], [message['id']])
+
+    def test_old_deletions_are_not_repeated(self):
+        message = self.send(self.alice, self.bob)
+        self.delete(message, self.bob, 'for_me')
+        MessageDeletion.objects.update(deleted_at=timezone.now() - 2 * SYNC_SAFETY_MARGIN)
+        page = self.poll(message['id'])
+        self.assertEqual(self.poll(message['id'], page['server_time'])['deleted'], [])
+
+    def test_group(self):
+        group = self.create_group(self.alice, self.bob)
+        first = self.send_to_group(self.alice, group, 'one')
+        self.send_to_group(self.alice, group, 'two')
+        page = self.poll(first['id'], url='/api/chat/group_messages/', group_id=group.id, username='bob')
+        self.assertEqual([message['content'] for message in page['messages']], ['two'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'after_id': 'latest'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'after_id': 0, 'since': 'yesterday'}).status_code, 400)
+
+
+class MessagePaginationTests(ChatTestCase):
+    url = '/api/chat/messages/user1=bob&user2=alice/'
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.send(self.alice, self.bob, str(number))['id'] for number in range(5)]
+
+    def page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        page = response.json()
+        return [message['id'] for message in page['messages']], page['next_before_id']
+
+    def test_newest_page_first_in_chronological_order(self):
+        self.assertEqual(self.page(limit=2), (self.ids[3:], self.ids[3]))
+
+    def test_walking_back_with_before_id(self):
+        ids, cursor = self.page(limit=2)
+        seen = ids
+        while cursor is not None:
+            ids, cursor = self.page(limit=2, before_id=cursor)
+            seen = ids + seen
+        self.assertEqual(seen, self.ids)
+        self.assertEqual(self.page(limit=2, before_id=self.ids[2]), (self.ids[:2], None))
+
+    def test_exact_fit_has_no_older_page(self):
+        self.assertEqual(self.page(limit=5), (self.ids, None))
+        self.assertEqual(self.page(limit=1, before_id=self.ids[0]), ([], None))
+
+    def test_hidden_messages_are_skipped(self):
+        self.client.delete(f'/api/chat/messages/{self.ids[3]}/?type=for_me&username=bob')
+        self.assertEqual(self.page(limit=2), ([self.ids[2], self.ids[4]], self.ids[2]))
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.page(limit=0), ([self.ids[-1]], self.ids[-1]))
+        with mock.patch('chat.views.MAX_MESSAGE_PAGE_SIZE', 3):
+            self.assertEqual(self.page(limit=MAX_MESSAGE_PAGE_SIZE + 1), (self.ids[2:], self.ids[2]))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'before_id': 'x'}).status_code, 400)
+
+
+class SearchTests(ChatTestCase):
+    def search(self, user, text, **params):
+        response = self.client.get('/api/chat/search/', {'username': user.username, 'q': text, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [message['content'] for message in response.json()['results']]
+
+    def test_words_and_prefixes(self):
+        self.send(self.alice, self.bob, 'Deploying the café release on Friday')
+        self.send(self.alice, self.bob, 'Nothing to see here')
+        self.assertEqual(self.search(self.bob, 'depl'), ['Deploying the café release on Friday'])
+        self.assertEqual(self.search(self.bob, 'friday depl'), ['Deploying the café release on Friday'])
+        self.assertEqual(self.search(self.bob, 'cafe'), ['Deploying the café release on Friday'])
+        self.assertEqual(self.search(self.bob, 'ploying'), [])
+        self.assertEqual(self.search(self.bob, 'friday nothing'), [])
+
+    def test_polls_match_their_question_and_options_only(self):
+        self.send_poll(options=('Pizza', 'Sushi'))
+        self.assertEqual(len(self.search(self.bob, 'sushi')), 1)
+        self.assertEqual(len(self.search(self.bob, 'lunch')), 1)
+        for key in ('type', 'poll', 'options', 'question', 'allowMultiple'):
+            self.assertEqual(self.search(self.bob, key), [], key)
+
+    def test_edits_and_deletions_for_everyone(self):
+        message = self.send(self.alice, self.bob, 'original wording')
+        Message.objects.filter(pk=message['id']).update(content='revised wording')
+        self.assertEqual(self.search(self.bob, 'original'), [])
+        self.assertEqual(self.search(self.bob, 'revised'), ['revised wording'])
+        self.client.delete(f"/api/chat/messages/{message['id']}/?type=for_everyone&username=alice")
+        self.assertEqual(self.search(self.bob, 'wording'), [])
+
+    def test_messages_deleted_for_the_user(self):
+        message = self.send(self.alice, self.bob, 'secret plan')
+        self.client.delete(f"/api/chat/messages/{message['id']}/?type=for_me&username=bob")
+        self.assertEqual(self.search(self.bob, 'secret'), [])
+        self.assertEqual(self.search(self.alice, 'secret'), ['secret plan'])
+
+    def test_only_conversations_the_user_is_in(self):
+        carol = User.objects.create_user('carol', password='pw')
+        self.send(self.alice, carol, 'private note')
+        group = self.create_group(self.alice, self.bob)
+        self.send_to_group(self.alice, group, 'group note')
+        self.assertEqual(self.search(self.bob, 'note'), ['group note'])
+        self.assertEqual(self.search(self.bob, 'note', group_id=group.id), ['group note'])
+        self.assertEqual(self.search(self.alice, 'note', partner='carol'), ['private note'])
+
+        self.client.post(f'/api/chat/groups/{group.id}/remove_member/', {'username': 'bob'}, content_type='application/json')
+        self.assertEqual(self.search(self.bob, 'note'), [])
+        self.assertEqual(sorted(self.search(self.alice, 'note')), ['group note', 'private note'])
+
+    def test_paging(self):
+        for number in range(3):
+            self.send(self.alice, self.bob, f'standup {number}')
+        response = self.client.get('/api/chat/search/', {'username': 'bob', 'q': 'standup', 'limit': 2}).json()
+        self.assertEqual(len(response['results']), 2)
+        self.assertEqual(response['next_offset'], 2)
+        response = self.client.get('/api/chat/search/', {'username': 'bob', 'q': 'standup', 'limit': 2, 'offset': 2}).json()
+        self.assertEqual(len(response['results']), 1)
+        self.assertIsNone(response['next_offset'])
+
+    def test_triggers_restored_after_a_table_rebuild(self):
+        # Migrations that rebuild chat_message drop its triggers; post_migrate puts them back
+        with connection.cursor() as cursor:
+            for suffix in ('insert', 'delete', 'update'):
+                cursor.execute(f"DROP TRIGGER {FTS_TABLE}_{suffix}")
+        restore_search_triggers(connection)
+        self.send(self.alice, self.bob, 'still indexed')
+        self.assertEqual(self.search(self.bob, 'indexed'), ['still indexed'])
+
+    def test_fallback_scan(self):
+        carol = User.objects.create_user('carol', password='pw')
+        self.send(self.alice, self.bob, 'Release notes')
+        self.send(self.alice, self.bob, 'notes for release')
+        hidden = self.send(self.alice, self.bob, 'release again')
+        self.send(self.alice, carol, 'release for carol')
+        self.client.delete(f"/api/chat/messages/{hidden['id']}/?type=for_me&username=bob")
+
+        messages, has_more = search_messages_fallback(self.bob, 'release NOTES', 10, 0, None, None)
+        self.assertEqual([message.content for message in messages], ['notes for release', 'Release notes'])
+        self.assertFalse(has_more)
+        messages, has_more = search_messages_fallback(self.bob, 'release', 1, 0, None, None)
+        self.assertEqual([message.content for message in messages], ['notes for release'])
+        self.assertTrue(has_more)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Polling reads go to a ``replica`` mirror of the test database once it holds
+    the poller's latest change. A TransactionTestCase, since reads inside a
+    transaction always stay on the primary.
+    """
+    databases = {'default', REPLICA_DB_ALIAS}
+    url = '/api/chat/messages/user1=bob&user2=alice/'
+
+    def setUp(self):
+        usercache._backend = None
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+
+    def send(self, content):
+        response = self.client.post('/api/chat/send/', {
+            'sender': 'alice', 'receiver': 'bob', 'content': content,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def poll(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA_DB_ALIAS]) as replica:
+            response = self.client.get(self.url, {'after_id': 0})
+        self.assertEqual(response.status_code, 200, response.content)
+        contents = [message['content'] for message in response.json()['messages']]
+        return contents, primary.captured_queries, replica.captured_queries
+
+    def test_fresh_replica_serves_the_poll(self):
+        self.send('one')
+        self.assertTrue(replica_has_changes_of(self.bob))
+        contents, primary, replica = self.poll()
+        self.assertEqual(contents, ['one'])
+        self.assertTrue(any('chat_message' in query['sql'] for query in replica))
+        self.assertFalse(any('chat_message' in query['sql'] for query in primary))
+
+    def test_stale_replica_falls_back_to_the_primary(self):
+        self.send('one')
+        latest = Change.objects.filter(user=self.bob).latest('id').pk
+
+        def lagging(execute, sql, params, many, context):
+            # The mirror shares the primary's data, so hide the newest change as a lagging replica would
+            if 'chat_change' in sql and latest in params:
+                params = tuple(0 if param == latest else param for param in params)
+            return execute(sql, params, many, context)
+
+        with connections[REPLICA_DB_ALIAS].execute_wrapper(lagging):
+            self.assertFalse(replica_has_changes_of(self.bob))
+            contents, primary, replica = self.poll()
+        self.assertEqual(contents, ['one'])
+        self.assertEqual(len(replica), 1)
+        self.assertIn('chat_change', replica[0]['sql'])
+        self.assertTrue(any('chat_message' in query['sql'] for query in primary))
+
+
+class ReadStateMigrationTests(TransactionTestCase):
+    """Existing histories count as read once read tracking is added (0020)"""
+    before = [('chat', '0019_conversationsummary')]
+    after = [('chat', '0020_read_state')]
+
+    def setUp(self):
+        usercache._backend = None
+        executor = MigrationExecutor(connection)
+        self.latest = executor.loader.graph.leaf_nodes('chat')
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        User_ = apps.get_model('auth', 'User')
+        Message_ = apps.get_model('chat', 'Message')
+        Group_ = apps.get_model('chat', 'Group')
+        ConversationSummary_ = apps.get_model('chat', 'ConversationSummary')
+
+        alice = User_.objects.create(username='alice')
+        bob = User_.objects.create(username='bob')
+        key = f'{min(alice.id, bob.id)}:{max(alice.id, bob.id)}'
+        for content in ('one', 'two'):
+            message = Message_.objects.create(sender=alice, receiver=bob, content=content, conversation=key)
+        ConversationSummary_.objects.create(owner=bob, partner=alice, last_message=message, last_preview='two')
+        ConversationSummary_.objects.create(owner=alice, partner=bob, last_message=message, last_preview='two')
+        group = Group_.objects.create(name='lunch')
+        group.members.set([alice, bob])
+        Message_.objects.create(sender=alice, group=group, content='hello')
+        self.alice_id, self.bob_id, self.group_id = alice.id, bob.id, group.id
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(self.latest)
+
+    def test_existing_messages_are_read(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.latest)
+
+        alice, bob = User.objects.get(pk=self.alice_id), User.objects.get(pk=self.bob_id)
+        ConversationSummary.refresh(bob, alice)
+        self.assertEqual(ConversationSummary.objects.get(owner=bob, partner=alice).unread_count, 0)
+        self.assertEqual(group_unread_counts(bob), {self.group_id: 0})
+
+        Message.objects.create(sender=alice, receiver=bob, content='three')
+        ConversationSummary.refresh(bob, alice)
+        self.assertEqual(ConversationSummary.objects.get(owner=bob, partner=alice).unread_count, 1)
@@ -0,0 +1,104 @@
+"""
+Background image variants for uploads.
+
+After an image upload is stored, ``schedule_variants`` queues it on an
+in-process thread pool (no broker needed). The worker writes resized
+copies next to the original, one per ``THUMBNAIL_SIZES`` entry, and a tiny
+blurred placeholder, then records them on the Upload row and publishes
+``upload.processed`` to everyone who can see a message using the image, so
+their change feeds (and ETags) move and they refetch it with imageVariants.
+The placeholder is a file of its own rather than an inline data URI, so
+messages repeating an image only repeat its URL and clients fetch it once.
+Pillow is optional: without it uploads simply get no variants.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+
+from . import events
+from .models import Upload
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_SIZE = 16
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2), thread_name_prefix='thumbnails'
+        )
+    return _executor
+
+
+def is_image(upload):
+    return upload.content_type.startswith('image/') and upload.content_type != 'image/svg+xml'
+
+
+def schedule_variants(upload):
+    """Queue variant generation for a new image upload once the current transaction commits"""
+    if Image is None or upload.placeholder or not is_image(upload):
+        return
+    upload_id = upload.pk
+    transaction.on_commit(lambda: get_executor().submit(generate_variants, upload_id))
+
+
+def generate_variants(upload_id):
+    """Worker task: write the resized variants and placeholder of one upload"""
+    try:
+        upload = Upload.objects.filter(pk=upload_id).first()
+        if upload is None or upload.placeholder:
+            return
+        with default_storage.open(upload.file.name, 'rb') as source:
+            image = Image.open(source)
+            image.load()
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        stem = os.path.splitext(upload.file.name)[0]
+        fmt, ext = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+
+        variants = {}
+        for name, max_side in settings.THUMBNAIL_SIZES.items():
+            if max(image.size) <= max_side:
+                continue  # the original is already small enough
+            variant = image.copy()
+            variant.thumbnail((max_side, max_side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            variant.save(buffer, fmt, **({'quality': 82, 'optimize': True} if fmt == 'JPEG' else {'optimize': True}))
+            path = f"{stem}_{name}.{ext}"
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(buffer.getvalue()))
+            variants[name] = {'path': path, 'width': variant.width, 'height': variant.height}
+
+        tiny = image.convert('RGB')
+        tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        tiny.save(buffer, 'JPEG', quality=40)
+        placeholder = f"{stem}_placeholder.jpg"
+        if not default_storage.exists(placeholder):
+            default_storage.save(placeholder, ContentFile(buffer.getvalue()))
+
+        with transaction.atomic():
+            upload.width, upload.height = image.width, image.height
+            upload.variants, upload.placeholder = variants, placeholder
+            upload.save(update_fields=['width', 'height', 'variants', 'placeholder'])
+            events.upload_processed(upload)
+    except Exception:
+        logger.exception("Could not generate image variants", extra={'upload_id': upload_id})
+    finally:
+        connections.close_all()
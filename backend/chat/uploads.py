@@ -0,0 +1,125 @@
+"""
+Content-addressed upload storage.
+
+``HashingFileUploadHandler`` streams each uploaded file to a temporary file
+next to the upload directory, hashing it chunk by chunk and enforcing
+``MAX_UPLOAD_SIZE`` as the bytes arrive. ``store_upload`` then files it under
+its SHA-256: a new file is moved into place with a rename (no second copy),
+and a file that is already stored is simply dropped, so forwarding the same
+image again costs no storage and no extra writes.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import IntegrityError
+from django.db.models import F
+
+from .models import Upload
+
+UPLOAD_DIR = 'chat_uploads'
+INCOMING_DIR = os.path.join(UPLOAD_DIR, '.incoming')
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+STORED_URL_RE = re.compile(UPLOAD_DIR + r'/[0-9a-f]{2}/([0-9a-f]{64})')
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """Streamed upload in the media incoming directory, with its SHA-256 once complete"""
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        incoming = os.path.join(settings.MEDIA_ROOT, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        # Same filesystem as the final location, so storing it is a rename
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=incoming)
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to disk while hashing them, stopping as soon as MAX_UPLOAD_SIZE is exceeded"""
+    chunk_size = 256 * 2 ** 10
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.hasher = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MAX_UPLOAD_SIZE:
+            # Let the view report it; the rest of the body is read and discarded
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=False)
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.sha256 = self.hasher.hexdigest()
+        return super().file_complete(file_size)
+
+
+def upload_extension(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext if EXTENSION_RE.match(ext) else ''
+
+
+def store_upload(uploaded_file):
+    """
+    Store a streamed upload under its content hash and return ``(upload, deduplicated)``.
+
+    Falls back to hashing and copying through ``default_storage`` for
+    uploads that did not come through HashingFileUploadHandler or storages
+    without local paths.
+    """
+    digest = getattr(uploaded_file, 'sha256', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in uploaded_file.chunks():
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        uploaded_file.seek(0)
+
+    existing = Upload.objects.filter(sha256=digest).first()
+    if existing is not None:
+        Upload.objects.filter(pk=existing.pk).update(upload_count=F('upload_count') + 1)
+        uploaded_file.close()
+        return existing, True
+
+    name = f"{UPLOAD_DIR}/{digest[:2]}/{digest}{upload_extension(uploaded_file.name)}"
+    if not default_storage.exists(name):
+        try:
+            final_path = default_storage.path(name)
+            temp_path = uploaded_file.temporary_file_path()
+        except (AttributeError, NotImplementedError):
+            name = default_storage.save(name, uploaded_file)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(temp_path, final_path)
+            # Temporary files are private (0600); give it the usual media permissions
+            os.chmod(final_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    uploaded_file.close()
+
+    try:
+        upload = Upload.objects.create(
+            sha256=digest, file=name, size=uploaded_file.size,
+            content_type=(uploaded_file.content_type or '')[:100],
+            original_name=(uploaded_file.name or '')[:255],
+        )
+    except IntegrityError:
+        # The same content was stored concurrently; the file on disk is identical
+        Upload.objects.filter(sha256=digest).update(upload_count=F('upload_count') + 1)
+        return Upload.objects.get(sha256=digest), True
+    return upload, False
+
+
+def upload_for_url(url):
+    """The Upload a stored file URL (as returned by upload_image) points at, or None"""
+    match = STORED_URL_RE.search(url or '')
+    if match is None:
+        return None
+    return Upload.objects.filter(sha256=match.group(1)).first()
@@ -1,7 +1,7 @@
 from django.urls import path
-from .views import RegisterView, LoginView, logout_view, UserListView, UserDetailView, MessageListView, SendMessageView, MessageDeleteView, PollVoteView, group_list, group_messages, CheckNewChatsView
+from .views import RegisterView, LoginView, logout_view, UserListView, UserDetailView, MessageListView, SendMessageView, MessageDeleteView, PollVoteView, group_list, group_messages, CheckNewChatsView, MarkReadView, UnreadCountsView, SearchView, SyncView
 
-from .views import add_group_member, remove_group_member, upload_image, friends_list, add_friend, RemoveFriendView, current_user
+from .views import add_group_member, remove_group_member, group_members, upload_image, friends_list, add_friend, RemoveFriendView, current_user, long_poll
 
 urlpatterns = [
     path('register/', RegisterView.as_view()),
@@ -16,8 +16,14 @@ urlpatterns = [
     path('messages/<int:pk>/', MessageDeleteView.as_view()),
     path('poll/vote/', PollVoteView.as_view()),
     path('check-new-chats/', CheckNewChatsView.as_view()),
+    path('read/', MarkReadView.as_view()),
+    path('unread/', UnreadCountsView.as_view()),
+    path('search/', SearchView.as_view()),
+    path('sync/', SyncView.as_view()),
+    path('long-poll/', long_poll),
     path('upload/', upload_image),
     path('groups/', group_list),
+    path('groups/<int:pk>/members/', group_members),
     path('groups/<int:pk>/add_member/', add_group_member),
     path('groups/<int:pk>/remove_member/', remove_group_member),
     path('group_messages/', group_messages),
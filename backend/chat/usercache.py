@@ -0,0 +1,133 @@
+"""
+Cached username -> user resolution for the hot endpoints.
+
+Almost every polling request names its user(s) by username. ``get_user``
+answers that from a cache of lightweight refs (id, username and names, the
+fields UserRefSerializer needs) and only queries on a miss. The returned
+User has its other fields deferred, so touching them still loads them
+correctly, and saving it only writes the loaded fields.
+
+The backend is chosen by ``USER_CACHE``: ``LocalLRUBackend`` keeps a bounded
+LRU per process, ``DjangoCacheBackend`` shares entries between workers
+through Django's cache framework. Saving or deleting a User invalidates its
+entry (see the receivers in chat.models); both backends also expire entries
+after ``timeout`` seconds, which bounds staleness from changes made without
+signals (``QuerySet.update``) or, with the local backend, in other processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+# Everything UserSerializer and UserRefSerializer read; UserSerializer's fields are built from this
+REF_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+
+class LocalLRUBackend:
+    """Per-process LRU of at most ``max_size`` users"""
+    def __init__(self, max_size=10000, timeout=300):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()  # username -> (ref, expires_at)
+        self.usernames = {}  # user id -> username, to invalidate after a rename
+        self.lock = threading.Lock()
+
+    def get(self, username):
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is None:
+                return None
+            ref, expires_at = entry
+            if expires_at < time.monotonic():
+                self._discard(username)
+                return None
+            self.entries.move_to_end(username)
+            return ref
+
+    def set(self, username, ref):
+        with self.lock:
+            self.entries[username] = (ref, time.monotonic() + self.timeout)
+            self.entries.move_to_end(username)
+            self.usernames[ref[0]] = username
+            while len(self.entries) > self.max_size:
+                self._discard(next(iter(self.entries)))
+
+    def delete(self, user_id, username):
+        with self.lock:
+            self._discard(username)
+            previous = self.usernames.get(user_id)
+            if previous is not None:
+                self._discard(previous)
+
+    def _discard(self, username):
+        entry = self.entries.pop(username, None)
+        if entry is not None and self.usernames.get(entry[0][0]) == username:
+            del self.usernames[entry[0][0]]
+
+
+class DjangoCacheBackend:
+    """Entries in one of Django's CACHES, shared by every worker using it"""
+    def __init__(self, alias='default', timeout=300, key_prefix='chat-user'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, username):
+        return self.cache.get(f'{self.key_prefix}:name:{username}')
+
+    def set(self, username, ref):
+        self.cache.set_many({
+            f'{self.key_prefix}:name:{username}': ref,
+            f'{self.key_prefix}:id:{ref[0]}': username,
+        }, self.timeout)
+
+    def delete(self, user_id, username):
+        keys = [f'{self.key_prefix}:name:{username}', f'{self.key_prefix}:id:{user_id}']
+        previous = self.cache.get(keys[1])
+        if previous is not None:
+            keys.append(f'{self.key_prefix}:name:{previous}')
+        self.cache.delete_many(keys)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'USER_CACHE', {})
+        backend_class = import_string(config.get('BACKEND', 'chat.usercache.LocalLRUBackend'))
+        _backend = backend_class(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def get_user(username):
+    """
+    The user named ``username`` with REF_FIELDS loaded, from the cache when
+    possible. Raises User.DoesNotExist like ``User.objects.get``.
+    """
+    if not username:
+        raise User.DoesNotExist("User matching query does not exist.")
+    backend = get_backend()
+    ref = backend.get(username)
+    if ref is None:
+        ref = User.objects.filter(username=username).values_list(*REF_FIELDS).first()
+        if ref is None:
+            raise User.DoesNotExist("User matching query does not exist.")
+        ref = tuple(ref)
+        backend.set(username, ref)
+    return User.from_db(DEFAULT_DB_ALIAS, REF_FIELDS, ref)
+
+
+def invalidate_user(user_id, username):
+    """Drop a user's entry, under its current and any previously cached username"""
+    get_backend().delete(user_id, username)
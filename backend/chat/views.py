@@ -1,63 +1,206 @@
+import logging
+from datetime import timedelta
+
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import check_password
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.http import JsonResponse
-from django.db.models import Q
-from rest_framework import generics, status
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import generics, serializers, status
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.response import Response
 from rest_framework.response import Response
-from .models import Message, User, Profile
-from .serializers import UserSerializer, MessageSerializer
+from rest_framework.utils import encoders
+from . import events
+from .models import Change, ConversationSummary, Friendship, Group, GroupReadState, Message, MessageDeletion, Poll, ResourceVersion, User, Profile, conversation_key
+from .routers import read_from_replica
+from .search import search_messages
+from .usercache import get_user
+from .serializers import ConversationSummarySerializer, UserSerializer, MessageSerializer
 from .serializers import UserSerializer
 
+logger = logging.getLogger(__name__)
+
+
+# Deletions are stamped before their transaction commits, so one that commits
+# after a poll can carry a time earlier than that poll's server_time. Clients
+# are told to resume this far back; re-reported ids are harmless. It must
+# exceed the longest write transaction, lock waits included (SQLITE_BUSY_TIMEOUT).
+SYNC_SAFETY_MARGIN = timedelta(seconds=60)
+
+
+def sync_messages(request, messages, user):
+    """
+    Incremental sync for a conversation queryset.
+
+    Returns only messages newer than ``after_id`` plus the ids of older
+    messages deleted (for everyone, or for this user) since ``since``.
+    Clients pass back ``last_id`` and ``server_time`` from the previous
+    response on their next poll; ``server_time`` lags the clock by
+    SYNC_SAFETY_MARGIN, so recent deletions may be reported more than once.
+    """
+    try:
+        after_id = int(request.query_params.get('after_id'))
+    except (TypeError, ValueError):
+        return Response({'error': 'after_id must be an integer'}, status=400)
+    since = request.query_params.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return Response({'error': 'since must be an ISO 8601 timestamp'}, status=400)
+
+    # Taken before querying, minus the margin for deletions still being committed
+    server_time = timezone.now() - SYNC_SAFETY_MARGIN
+
+    new_messages = list(messages.visible_to(user).filter(id__gt=after_id).order_by('id'))
+
+    deleted_ids = []
+    if since:
+        older = messages.filter(id__lte=after_id)
+        deleted_ids = list(
+            older.filter(deleted_for_everyone=True, deleted_at__gte=since).values_list('id', flat=True).union(
+                MessageDeletion.objects.filter(
+                    user=user, deleted_at__gte=since, message__in=older
+                ).values_list('message_id', flat=True)
+            )
+        )
+
+    return Response({
+        'messages': MessageSerializer(new_messages, many=True).data,
+        'deleted': deleted_ids,
+        'last_id': new_messages[-1].id if new_messages else after_id,
+        'server_time': serializers.DateTimeField().to_representation(server_time),
+    })
+
+
+def latest_change_seq(user):
+    """Sequence number of the user's newest change feed entry (0 if none)"""
+    return Change.objects.filter(user=user).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def user_feed_etag(prefix, username_param='username'):
+    """
+    ETag function for views whose body only changes when the user's change
+    feed or any user profile does. Computed without building the body.
+    """
+    def etag(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        username = kwargs.get(username_param) or request.GET.get(username_param)
+        try:
+            user = get_user(username)
+        except User.DoesNotExist:
+            return None
+        users_version, = ResourceVersion.current('users')
+        return f"{prefix}-{user.id}-{latest_change_seq(user)}-{users_version}"
+    return etag
+
+
+def resource_etag(prefix, *names):
+    """ETag function for views over shared resources tracked by ResourceVersion"""
+    def etag(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        return f"{prefix}-" + "-".join(str(version) for version in ResourceVersion.current(*names))
+    return etag
+
+
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+
+def paginate_messages(request, messages, user):
+    """
+    Keyset pagination for a conversation queryset, newest page first.
+
+    Returns up to ``limit`` messages older than ``before_id`` (or the latest
+    ones when it is omitted) in chronological order. ``next_before_id`` is
+    the cursor for the next older page, or None once the start of the
+    conversation has been reached.
+    """
+    try:
+        limit = int(request.query_params.get('limit', MESSAGE_PAGE_SIZE))
+        before_id = request.query_params.get('before_id')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return Response({'error': 'limit and before_id must be integers'}, status=400)
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+
+    messages = messages.visible_to(user).order_by('-id')
+    if before_id is not None:
+        messages = messages.filter(id__lt=before_id)
+
+    # Fetch one extra row to know whether an older page exists
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return Response({
+        'messages': MessageSerializer(page, many=True).data,
+        'next_before_id': page[0].id if has_more else None,
+    })
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class PollVoteView(APIView):
     def post(self, request):
-        print(f"PollVoteView.post called")
-        print(f"Request data: {request.data}")
-        
         message_id = request.data.get('message_id')
         voter = request.data.get('voter')
         selected = request.data.get('selected')  # can be str or list
         
-        print(f"Parsed data: message_id={message_id}, voter={voter}, selected={selected}")
-        
         if not (message_id and voter and selected is not None):
-            print(f"Validation failed: message_id={message_id}, voter={voter}, selected={selected}")
+            logger.info("Poll vote rejected: missing fields", extra={'message_id': message_id, 'voter': voter})
             return Response({'error': 'message_id, voter, and selected required'}, status=400)
         try:
-            msg = Message.objects.get(pk=message_id)
-            print(f"Found message: {msg.id}")
-        except Message.DoesNotExist:
-            print(f"Message not found: {message_id}")
+            msg = Message.objects.select_related('poll').get(pk=message_id)
+            poll = msg.poll
+        except (Message.DoesNotExist, Poll.DoesNotExist):
+            logger.info("Poll vote rejected: poll message not found", extra={'message_id': message_id})
             return Response({'error': 'Poll message not found'}, status=404)
-        # pollVotes: {voter_username: [option_idx,...]} or [option_idx]
-        votes = msg.pollVotes or {}
+        # Voters are identified by username, or by id for clients without one
+        try:
+            voter_user = get_user(voter)
+        except User.DoesNotExist:
+            voter_user = None
+        if voter_user is None and str(voter).isdigit():
+            voter_user = User.objects.filter(pk=int(voter)).first()
+        if voter_user is None:
+            return Response({'error': 'Voter not found'}, status=404)
         # Support single/multi answer
-        if isinstance(selected, int):
+        if not isinstance(selected, list):
             selected = [selected]
-        elif isinstance(selected, str):
-            try:
-                selected = [int(selected)]
-            except Exception:
-                print(f"Invalid selected option: {selected}")
-                return Response({'error': 'Invalid selected option'}, status=400)
-        elif isinstance(selected, list):
-            selected = [int(i) for i in selected]
+        try:
+            selected = {int(i) for i in selected}
+        except (TypeError, ValueError):
+            logger.info("Poll vote rejected: invalid options", extra={'message_id': msg.id, 'selected': selected})
+            return Response({'error': 'Invalid selected option'}, status=400)
+        if not selected <= set(poll.options.values_list('position', flat=True)):
+            return Response({'error': 'Invalid selected option'}, status=400)
+        if len(selected) > 1 and not poll.allow_multiple:
+            return Response({'error': 'This poll allows only one option'}, status=400)
         
-        print(f"Final selected: {selected}")
-        votes[voter] = selected
-        msg.pollVotes = votes
-        msg.save()
-        print(f"Vote saved successfully")
-        return Response(MessageSerializer(msg).data)
+        with transaction.atomic():
+            tallies = poll.record_vote(voter_user, selected)
+            data = {
+                'message_id': msg.id,
+                'voter': voter_user.username,
+                'selected': sorted(selected),
+                'tallies': tallies,
+                'totalVotes': sum(tallies),
+            }
+            events.poll_voted(msg, data)
+        logger.debug("Poll vote recorded", extra={'message_id': msg.id, 'voter_id': voter_user.id, 'selected': sorted(selected)})
+        return Response(data)
 
 class RegisterView(APIView):
     authentication_classes = []  # No authentication required for registration
@@ -82,12 +225,9 @@ class LoginView(APIView):
     permission_classes = []      # No permissions required for login
     
     def post(self, request):
-        print(f"LoginView.post called - Method: {request.method}")
-        print(f"Request headers: {dict(request.headers)}")
-        print(f"Request data: {request.data}")
-        
         username = request.data.get('username')
         password = request.data.get('password')
+        logger.debug("Login attempt", extra={'username': username})
         
         if not username or not password:
             return Response({'error': 'Username and password required'}, status=400)
@@ -110,8 +250,9 @@ def logout_view(request):
     logout(request)
     return Response({'message': 'Logged out successfully'})
 
+@method_decorator(condition(etag_func=resource_etag('users', 'users')), name='get')
 class UserListView(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('profile').prefetch_related('friendships')
     serializer_class = UserSerializer
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -123,103 +264,232 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     
     def update(self, request, *args, **kwargs):
         try:
-            print(f"UserDetailView.update called")
-            print(f"Request user: {request.user}")
-            print(f"Request data: {request.data}")
-            
             # Get the user instance
             user = self.get_object()
-            print(f"Target user: {user}")
-            
-            # Temporarily allow all updates for debugging
-            print("Allowing profile update for debugging")
+            logger.debug("Profile update", extra={'request_user': str(request.user), 'target_user_id': user.id})
             
             # Ensure the user has a profile
             try:
                 profile = user.profile
-                print(f"User profile exists: {profile}")
             except Profile.DoesNotExist:
                 profile = Profile.objects.create(user=user)
-                print(f"Created profile: {profile}")
             
-            result = super().update(request, *args, **kwargs)
-            print(f"Update result: {result}")
-            return result
+            return super().update(request, *args, **kwargs)
         except Exception as e:
-            print(f"Error updating user profile: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error updating user profile", extra={'target_user_id': kwargs.get('pk')})
             return Response({'error': f'Failed to update profile: {str(e)}'}, status=500)
 
 class MessageListView(APIView):
+    @method_decorator(read_from_replica('user1'))
+    @method_decorator(condition(etag_func=user_feed_etag('messages', username_param='user1')))
     def get(self, request, user1, user2):
         if not user1 or not user2:
             return Response({'error': 'user1 and user2 required'}, status=400)
         
         try:
-            user1_obj = User.objects.get(username=user1)
-            user2_obj = User.objects.get(username=user2)
+            user1_obj = get_user(user1)
+            user2_obj = get_user(user2)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=404)
         
-        # Helper function to check if message is deleted for a user
-        def is_deleted_for_user(msg, user_id):
-            if not msg.deleted_for_users:
-                return False
-            return str(user_id) in msg.deleted_for_users.split(',')
-        
-        messages = Message.objects.filter(
-            (Q(sender__username=user1) & Q(receiver__username=user2)) |
-            (Q(sender__username=user2) & Q(receiver__username=user1))
-        ).filter(
-            # Filter out messages deleted for everyone
-            deleted_for_everyone=False
-        ).order_by('timestamp')
-        
-        # Filter out messages deleted for the requesting user (in Python)
-        messages = [msg for msg in messages if not is_deleted_for_user(msg, user1_obj.id)]
+        messages = Message.objects.with_related().filter(
+            conversation=conversation_key(user1_obj.id, user2_obj.id)
+        )
+        if 'after_id' in request.query_params:
+            return sync_messages(request, messages, user1_obj)
+        if 'limit' in request.query_params or 'before_id' in request.query_params:
+            return paginate_messages(request, messages, user1_obj)
+
+        # Filter out messages deleted for everyone or for the requesting user
+        messages = messages.visible_to(user1_obj).order_by('id')
         
         return Response(MessageSerializer(messages, many=True).data)
 
 class CheckNewChatsView(APIView):
+    @method_decorator(read_from_replica())
+    @method_decorator(condition(etag_func=user_feed_etag('chats')))
     def get(self, request):
         username = request.query_params.get('username')
         if not username:
             return Response({'error': 'username required'}, status=400)
         
         try:
-            user = User.objects.get(username=username)
+            user = get_user(username)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=404)
         
-        # Helper function to check if message is deleted for a user
-        def is_deleted_for_user(msg, user_id):
-            if not msg.deleted_for_users:
-                return False
-            return str(user_id) in msg.deleted_for_users.split(',')
+        # One indexed read of the user's inbox, most recent conversation first
+        summaries = ConversationSummary.objects.filter(
+            owner=user, last_message__isnull=False
+        ).select_related('partner__profile').prefetch_related('partner__friendships').order_by('-last_timestamp')
         
-        # Get all users who have sent messages to this user
-        message_senders = Message.objects.filter(
-            receiver=user,
-            deleted_for_everyone=False
-        )
-        # Filter in Python
-        message_senders = [msg for msg in message_senders if not is_deleted_for_user(msg, user.id)]
-        sender_ids = list(set([msg.sender.id for msg in message_senders]))
+        return Response(ConversationSummarySerializer(summaries, many=True).data)
+
+class MarkReadView(APIView):
+    def post(self, request):
+        """Mark a DM (``partner``) or a group (``group_id``) as read up to ``up_to_id``"""
+        username = request.data.get('username')
+        partner_username = request.data.get('partner')
+        group_id = request.data.get('group_id')
+        try:
+            up_to_id = int(request.data.get('up_to_id'))
+        except (TypeError, ValueError):
+            return Response({'error': 'up_to_id must be an integer'}, status=400)
+        if not username or not (partner_username or group_id):
+            return Response({'error': 'username and partner or group_id required'}, status=400)
         
-        # Get all users who have received messages from this user
-        message_receivers = Message.objects.filter(
-            sender=user,
-            deleted_for_everyone=False
-        ).values_list('receiver', flat=True).distinct()
+        try:
+            user = User.objects.get(username=username)
+            if partner_username:
+                partner = User.objects.get(username=partner_username)
+            else:
+                group = Group.objects.get(pk=group_id, members=user)
+        except (User.DoesNotExist, Group.DoesNotExist):
+            return Response({'error': 'User or group not found'}, status=404)
         
-        # Combine and get unique user IDs
-        all_chat_user_ids = set(sender_ids + list(message_receivers))
+        if partner_username:
+            with transaction.atomic():
+                summary = ConversationSummary.mark_read(user, partner, up_to_id)
+                events.conversation_read(user, partner, up_to_id)
+            return Response({'partner': partner.username, 'unread_count': summary.unread_count if summary else 0})
         
-        # Get user objects
-        chat_users = User.objects.filter(id__in=all_chat_user_ids)
+        with transaction.atomic():
+            GroupReadState.mark_read(user, group, up_to_id)
+            events.group_read(user, group, up_to_id)
+        return Response({'group_id': group.id, 'unread_count': group_unread_counts(user).get(group.id, 0)})
+
+def group_unread_counts(user, group_ids=None):
+    """
+    Unread messages per group for a member: those visible to them (same
+    rules as group_messages) from other senders after their read position.
+    """
+    last_read = GroupReadState.objects.filter(user=user, group=OuterRef('pk')).values('last_read_id')
+    unread = Message.objects.visible_to(user).filter(
+        group=OuterRef('pk'), id__gt=OuterRef('read_up_to'),
+    ).exclude(sender=user).order_by().values('group').annotate(count=Count('id')).values('count')
+    groups = Group.objects.filter(members=user)
+    if group_ids is not None:
+        groups = groups.filter(pk__in=group_ids)
+    groups = groups.annotate(
+        read_up_to=Coalesce(Subquery(last_read), 0)
+    ).annotate(
+        unread=Coalesce(Subquery(unread), 0)
+    )
+    return dict(groups.values_list('id', 'unread'))
+
+class UnreadCountsView(APIView):
+    def get(self, request):
+        """Unread counts for all of a user's DMs and groups"""
+        username = request.query_params.get('username')
+        if not username:
+            return Response({'error': 'username required'}, status=400)
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            return Response({'error': 'User not found'}, status=404)
         
-        return Response(UserSerializer(chat_users, many=True).data)
+        direct = ConversationSummary.objects.filter(owner=user, unread_count__gt=0).values_list(
+            'partner__username', 'unread_count'
+        )
+        return Response({
+            'direct': dict(direct),
+            'groups': group_unread_counts(user),
+        })
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+class SearchView(APIView):
+    def get(self, request):
+        """
+        Full-text search over the messages a user can see, best match first.
+
+        ``q`` is matched word by word (the last word as a prefix); ``partner``
+        or ``group_id`` limit it to one conversation. Paginated with
+        ``limit``/``offset``; ``next_offset`` is None on the last page.
+        """
+        username = request.query_params.get('username')
+        text = request.query_params.get('q', '').strip()
+        partner_username = request.query_params.get('partner')
+        group_id = request.query_params.get('group_id')
+        if not username or not text:
+            return Response({'error': 'username and q required'}, status=400)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE))
+            offset = max(0, int(request.query_params.get('offset', 0)))
+            group_id = int(group_id) if group_id else None
+        except ValueError:
+            return Response({'error': 'limit, offset and group_id must be integers'}, status=400)
+
+        partner = group = None
+        try:
+            user = User.objects.get(username=username)
+            if partner_username:
+                partner = User.objects.get(username=partner_username)
+            elif group_id is not None:
+                group = Group.objects.get(pk=group_id, members=user)
+        except (User.DoesNotExist, Group.DoesNotExist):
+            return Response({'error': 'User or group not found'}, status=404)
+
+        messages, has_more = search_messages(user, text, limit, offset, partner=partner, group=group)
+        results = MessageSerializer(messages, many=True).data
+        for message, data in zip(messages, results):
+            data['group_id'] = message.group_id
+        return Response({
+            'results': results,
+            'next_offset': offset + limit if has_more else None,
+        })
+
+CHANGE_PAGE_SIZE = 200
+
+def read_change_feed(user, since):
+    """
+    Page of a user's change feed after ``since`` as a response dict.
+
+    ``reset`` is set when entries after ``since`` may have been compacted
+    away; ``seq`` is then the position to continue from after a reload.
+    ``since=0`` means nothing has been seen yet and starts from the oldest
+    retained entry.
+    """
+    oldest = Change.objects.order_by('id').values_list('id', flat=True).first()
+    if since and oldest is not None and since < oldest - 1:
+        latest = Change.objects.filter(user=user).order_by('-id').values_list('id', flat=True).first()
+        return {'changes': [], 'seq': latest or oldest - 1, 'has_more': False, 'reset': True}
+    
+    changes = list(Change.objects.filter(user=user, id__gt=since).select_related('event').order_by('id')[:CHANGE_PAGE_SIZE + 1])
+    return {
+        'changes': [
+            {'seq': change.id, 'type': change.event.kind, 'data': change.event.data, 'created_at': change.created_at}
+            for change in changes[:CHANGE_PAGE_SIZE]
+        ],
+        'seq': changes[:CHANGE_PAGE_SIZE][-1].id if changes else since,
+        'has_more': len(changes) > CHANGE_PAGE_SIZE,
+        'reset': False,
+    }
+
+class SyncView(APIView):
+    def get(self, request):
+        """
+        Everything that changed for a user since a sequence number, from the change feed.
+
+        Clients keep the returned ``seq`` and pass it back as ``since``. When
+        entries after ``since`` have been compacted away the response has
+        ``reset`` set and the client should reload its state from the list
+        endpoints, then continue from the returned ``seq``.
+        """
+        username = request.query_params.get('username')
+        if not username:
+            return Response({'error': 'username required'}, status=400)
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            return Response({'error': 'since must be an integer'}, status=400)
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            return Response({'error': 'User not found'}, status=404)
+        
+        return Response(read_change_feed(user, since))
 
 class MessageDeleteView(APIView):
     def delete(self, request, pk):
@@ -231,7 +501,7 @@ class MessageDeleteView(APIView):
         
         try:
             msg = Message.objects.get(pk=pk)
-            user = User.objects.get(username=username)
+            user = get_user(username)
         except (Message.DoesNotExist, User.DoesNotExist):
             return Response({'error': 'Message or user not found'}, status=404)
         
@@ -254,14 +524,13 @@ class MessageDeleteView(APIView):
                 return Response({'error': 'You can only delete messages you sent or received'}, status=403)
         
         if delete_type == 'for_me':
-            # Add user to deleted_for_users list
-            deleted_users = msg.deleted_for_users.split(',') if msg.deleted_for_users else []
-            deleted_users = [uid.strip() for uid in deleted_users if uid.strip()]  # Remove empty strings
-            
-            if str(user.id) not in deleted_users:
-                deleted_users.append(str(user.id))
-                msg.deleted_for_users = ','.join(deleted_users)
-                msg.save()
+            with transaction.atomic():
+                deletion, created = MessageDeletion.objects.get_or_create(message=msg, user=user)
+                if created:
+                    if not is_group_message:
+                        partner = msg.receiver if msg.sender == user else msg.sender
+                        ConversationSummary.refresh(user, partner)
+                    events.message_deleted(msg, [user.id], delete_type)
             return Response({'success': 'Message deleted for you'})
         
         elif delete_type == 'for_everyone':
@@ -270,8 +539,14 @@ class MessageDeleteView(APIView):
                 return Response({'error': 'Only the sender can delete messages for everyone'}, status=403)
             
             # Mark as deleted for everyone
-            msg.deleted_for_everyone = True
-            msg.save()
+            with transaction.atomic():
+                msg.deleted_for_everyone = True
+                msg.deleted_at = timezone.now()
+                msg.save()
+                if not is_group_message:
+                    ConversationSummary.refresh(msg.sender, msg.receiver)
+                    ConversationSummary.refresh(msg.receiver, msg.sender)
+                events.message_deleted(msg, events.message_recipients(msg), delete_type)
             return Response({'success': 'Message deleted for everyone'})
         
         else:
@@ -289,15 +564,15 @@ class SendMessageView(APIView):
         if not (sender_username and receiver_username):
             return Response({'error': 'sender and receiver required'}, status=400)
         try:
-            sender = User.objects.get(username=sender_username)
-            receiver = User.objects.get(username=receiver_username)
+            sender = get_user(sender_username)
+            receiver = get_user(receiver_username)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=404)
 
-        # Auto-create chat relationship: Ensure both users have profiles
+        # Auto-create chat relationship: Ensure both users have profiles (kept on the users for sender_info/receiver_info)
         from .models import Profile
-        sender_profile, created = Profile.objects.get_or_create(user=sender)
-        receiver_profile, created = Profile.objects.get_or_create(user=receiver)
+        sender.profile, created = Profile.objects.get_or_create(user=sender)
+        receiver.profile, created = Profile.objects.get_or_create(user=receiver)
         documentUrl = request.data.get('documentUrl', '')
         documentName = request.data.get('documentName', '')
         if msg_type == 'poll':
@@ -305,15 +580,22 @@ class SendMessageView(APIView):
             if not poll or not poll.get('question') or not poll.get('options'):
                 return Response({'error': 'Poll question and options required'}, status=400)
             content = json.dumps({'type': 'poll', 'question': poll['question'], 'options': poll['options'], 'allowMultiple': poll.get('allowMultiple', False)})
-            msg = Message.objects.create(sender=sender, receiver=receiver, content=content)
-        else:
-            if not (content or imageUrl or documentUrl):
-                return Response({'error': 'content, imageUrl, or documentUrl required'}, status=400)
-            msg = Message.objects.create(sender=sender, receiver=receiver, content=content, imageUrl=imageUrl, documentUrl=documentUrl, documentName=documentName)
-        
+        elif not (content or imageUrl or documentUrl):
+            return Response({'error': 'content, imageUrl, or documentUrl required'}, status=400)
+
+        with transaction.atomic():
+            if msg_type == 'poll':
+                msg = Message.objects.create(sender=sender, receiver=receiver, content=content)
+                Poll.create_for_message(msg, poll['question'], poll['options'], poll.get('allowMultiple', False))
+            else:
+                msg = Message.objects.create(sender=sender, receiver=receiver, content=content, imageUrl=imageUrl, documentUrl=documentUrl, documentName=documentName, image_upload=upload_for_url(imageUrl))
+            ConversationSummary.record_message(msg)
+            message_data = MessageSerializer(msg).data
+            events.message_created(msg, message_data)
+
         # Return both the message and user info for auto-adding to friends list
         response_data = {
-            'message': MessageSerializer(msg).data,
+            'message': message_data,
             'sender_info': UserSerializer(sender).data,
             'receiver_info': UserSerializer(receiver).data
         }
@@ -326,11 +608,68 @@ class SendMessageView(APIView):
 # --- Group API ---
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.core.files.storage import default_storage
 from django.conf import settings
+from .thumbnails import schedule_variants
+from .uploads import store_upload, upload_for_url
 from rest_framework.response import Response
 from .models import Group
-from .serializers import GroupSerializer
+from .serializers import GroupSerializer, GroupSummarySerializer, UserRefSerializer
+
+GROUP_PAGE_SIZE = 50
+MAX_GROUP_PAGE_SIZE = 200
+GROUP_MEMBER_PREVIEW = 3
+
+
+def read_page_params(request, default_limit, max_limit):
+    """Parse ``limit``/``after_id`` for keyset-paginated lists; returns (limit, after_id) or an error Response"""
+    try:
+        limit = int(request.query_params.get('limit', default_limit))
+        after_id = int(request.query_params.get('after_id', 0))
+    except ValueError:
+        return Response({'error': 'limit and after_id must be integers'}, status=400)
+    return max(1, min(limit, max_limit)), after_id
+
+
+def attach_member_previews(groups):
+    """Set ``members_preview`` on each group with its first few members, in one query"""
+    Membership = Group.members.through
+    rows = Membership.objects.filter(
+        group_id__in=[group.id for group in groups]
+    ).annotate(
+        rank=Window(RowNumber(), partition_by=[F('group_id')], order_by=F('user_id').asc())
+    ).filter(rank__lte=GROUP_MEMBER_PREVIEW).select_related('user').order_by('group_id', 'user_id')
+    previews = {}
+    for row in rows:
+        previews.setdefault(row.group_id, []).append(row.user)
+    for group in groups:
+        group.members_preview = previews.get(group.id, [])
+
+
+def user_group_page(request, user):
+    """
+    The groups ``user`` belongs to, ordered by id and paginated with
+    ``limit``/``after_id``. Each group carries its member count and a
+    short member preview; full membership is served by ``group_members``.
+    """
+    params = read_page_params(request, GROUP_PAGE_SIZE, MAX_GROUP_PAGE_SIZE)
+    if isinstance(params, Response):
+        return params
+    limit, after_id = params
+
+    Membership = Group.members.through
+    groups = Group.objects.filter(
+        id__in=Membership.objects.filter(user=user).values('group_id'),
+        id__gt=after_id,
+    ).annotate(member_count=Count('members')).order_by('id')
+
+    page = list(groups[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    attach_member_previews(page)
+    return Response({
+        'groups': GroupSummarySerializer(page, many=True).data,
+        'next_after_id': page[-1].id if has_more else None,
+    })
 
 @api_view(['POST'])
 def add_group_member(request, pk):
@@ -345,8 +684,11 @@ def add_group_member(request, pk):
         user = User.objects.get(username=username)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-    group.members.add(user)
-    group.save()
+    with transaction.atomic():
+        group.members.add(user)
+        group.save()
+        recipients = set(group.members.values_list('id', flat=True))
+        events.group_member_changed(group, user, 'group.member_added', recipients)
     return Response({'success': True})
 
 @api_view(['POST'])
@@ -362,11 +704,31 @@ def remove_group_member(request, pk):
         user = User.objects.get(username=username)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-    group.members.remove(user)
-    group.save()
+    with transaction.atomic():
+        recipients = set(group.members.values_list('id', flat=True)) | {user.id}
+        group.members.remove(user)
+        group.save()
+        events.group_member_changed(group, user, 'group.member_removed', recipients)
     return Response({'success': True})
 
+group_feed_etag = user_feed_etag('group-messages')
+
+def group_messages_etag(request):
+    """The member's feed ETag; None for anyone else, so the view always runs and answers 403"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    group_id = request.GET.get('group_id', '')
+    try:
+        user = get_user(request.GET.get('username'))
+    except User.DoesNotExist:
+        return None
+    if not group_id.isdigit() or not Group.members.through.objects.filter(group_id=group_id, user_id=user.id).exists():
+        return None
+    return group_feed_etag(request)
+
 @api_view(['GET', 'POST'])
+@read_from_replica()
+@condition(etag_func=group_messages_etag)
 def group_messages(request):
     from .models import Group
     if request.method == 'GET':
@@ -380,23 +742,20 @@ def group_messages(request):
             
         try:
             group = Group.objects.get(pk=group_id)
-            user = User.objects.get(username=username)
+            user = get_user(username)
         except (Group.DoesNotExist, User.DoesNotExist):
             return Response({'error': 'Group or user not found'}, status=404)
+        if not group.members.filter(pk=user.pk).exists():
+            return Response({'error': 'You can only read groups you are a member of'}, status=403)
+
+        messages = group.messages.with_related()
+        if 'after_id' in request.query_params:
+            return sync_messages(request, messages, user)
+        if 'limit' in request.query_params or 'before_id' in request.query_params:
+            return paginate_messages(request, messages, user)
         
-        # Helper function to check if message is deleted for a user
-        def is_deleted_for_user(msg, user_id):
-            if not msg.deleted_for_users:
-                return False
-            return str(user_id) in msg.deleted_for_users.split(',')
-            
         # Filter out messages deleted for everyone and deleted for this user
-        messages = group.messages.filter(
-            deleted_for_everyone=False
-        ).order_by('timestamp')
-        
-        # Filter out messages deleted for this user (in Python)
-        messages = [msg for msg in messages if not is_deleted_for_user(msg, user.id)]
+        messages = messages.visible_to(user).order_by('id')
         
         return Response(MessageSerializer(messages, many=True).data)
     elif request.method == 'POST':
@@ -410,7 +769,7 @@ def group_messages(request):
         if not (sender_username and group_id):
             return Response({'error': 'sender and group_id required'}, status=400)
         try:
-            sender = User.objects.get(username=sender_username)
+            sender = get_user(sender_username)
             group = Group.objects.get(pk=group_id)
         except (User.DoesNotExist, Group.DoesNotExist):
             return Response({'error': 'Sender or group not found'}, status=404)
@@ -419,65 +778,114 @@ def group_messages(request):
             content = json.dumps({'type': 'poll', **poll})
         if not (content or imageUrl or documentUrl):
             return Response({'error': 'content, imageUrl, or documentUrl required'}, status=400)
-        msg = Message.objects.create(
-            sender=sender, group=group, content=content,
-            imageUrl=imageUrl, documentUrl=documentUrl, documentName=documentName
-        )
-        return Response(MessageSerializer(msg).data, status=201)
+        with transaction.atomic():
+            msg = Message.objects.create(
+                sender=sender, group=group, content=content,
+                imageUrl=imageUrl, documentUrl=documentUrl, documentName=documentName,
+                image_upload=upload_for_url(imageUrl),
+            )
+            if poll:
+                Poll.create_for_message(msg, poll.get('question', ''), poll.get('options') or [], poll.get('allowMultiple', False))
+            # The sender has read their own group up to this message
+            GroupReadState.mark_read(sender, group, msg.id)
+            message_data = MessageSerializer(msg).data
+            events.message_created(msg, message_data)
+        return Response(message_data, status=201)
 
 @api_view(['GET', 'POST'])
+@read_from_replica()
+@condition(etag_func=resource_etag('groups', 'groups', 'users'))
 def group_list(request):
     if request.method == 'GET':
-        groups = Group.objects.all()
+        username = request.query_params.get('username')
+        if username:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                return Response({'error': 'User not found'}, status=404)
+            return user_group_page(request, user)
+
+        # Legacy: every group with every member nested
+        groups = Group.objects.prefetch_related(
+            Prefetch('members', queryset=User.objects.select_related('profile').prefetch_related('friendships'))
+        )
         serializer = GroupSerializer(groups, many=True)
         return Response(serializer.data)
     elif request.method == 'POST':
         serializer = GroupSerializer(data=request.data)
         if serializer.is_valid():
-            group = Group.objects.create(name=serializer.validated_data['name'])
-            members = request.data.get('member_ids', [])
-            group.members.set(members)
-            group.save()
+            with transaction.atomic():
+                group = Group.objects.create(name=serializer.validated_data['name'])
+                members = request.data.get('member_ids', [])
+                group.members.set(members)
+                group.save()
+                events.group_created(group)
             return Response(GroupSerializer(group).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@condition(etag_func=resource_etag('group-members', 'groups', 'users'))
+def group_members(request, pk):
+    """Members of a group ordered by user id, paginated with ``limit``/``after_id``"""
+    try:
+        group = Group.objects.get(pk=pk)
+    except Group.DoesNotExist:
+        return Response({'error': 'Group not found'}, status=status.HTTP_404_NOT_FOUND)
+    params = read_page_params(request, GROUP_PAGE_SIZE, MAX_GROUP_PAGE_SIZE)
+    if isinstance(params, Response):
+        return params
+    limit, after_id = params
+
+    page = list(group.members.filter(id__gt=after_id).order_by('id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    return Response({
+        'members': UserRefSerializer(page, many=True).data,
+        'next_after_id': page[-1].id if has_more else None,
+    })
+
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def upload_image(request):
     file_obj = request.FILES.get('file')
     if not file_obj:
+        if getattr(request, 'upload_too_large', False):
+            return Response({'error': f'File too large (limit {settings.MAX_UPLOAD_SIZE} bytes)'}, status=413)
         return Response({'error': 'No file uploaded'}, status=400)
-    file_path = default_storage.save(f'chat_uploads/{file_obj.name}', file_obj)
-    file_url = request.build_absolute_uri(settings.MEDIA_URL + file_path.split('media/')[-1])
-    return Response({'url': file_url})
+    # Stored under its content hash; re-uploading the same bytes reuses the stored file
+    upload, deduplicated = store_upload(file_obj)
+    schedule_variants(upload)
+    return Response({
+        'url': request.build_absolute_uri(upload.file.url),
+        'sha256': upload.sha256,
+        'size': upload.size,
+        'deduplicated': deduplicated,
+    })
+
+def friends_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    users_version, = ResourceVersion.current('users')
+    return f"friends-{request.user.id}-{latest_change_seq(request.user)}-{users_version}"
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=friends_etag)
 def friends_list(request):
-    # Ensure user has a profile
-    profile, created = Profile.objects.get_or_create(user=request.user)
-    # Get friend user objects from the list of friend IDs
-    friend_users = User.objects.filter(id__in=profile.friends)
-    # Clean up the profile.friends list if there are stale IDs
-    existing_ids = set(user.id for user in friend_users)
-    if set(profile.friends) != existing_ids:
-        profile.friends = list(existing_ids)
-        profile.save()
+    friend_users = User.objects.filter(
+        friend_of__user=request.user
+    ).select_related('profile').prefetch_related('friendships')
     return Response(UserSerializer(friend_users, many=True).data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def current_user(request):
     """Get the current authenticated user's data"""
-    print(f"current_user called - user: {request.user}")
     return Response(UserSerializer(request.user).data)
 
 @csrf_exempt
 def add_friend(request, user_id):
-    print(f"DEBUG: add_friend called with user_id: {user_id}")
-    print(f"DEBUG: Request method: {request.method}")
-    print(f"DEBUG: Request body: {request.body}")
-    print(f"DEBUG: Request headers: {dict(request.headers)}")
+    logger.debug("add_friend", extra={'friend_id': user_id, 'method': request.method})
     
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
@@ -492,19 +900,10 @@ def add_friend(request, user_id):
         # Get the user to be added as friend
         friend_user = User.objects.get(id=user_id)
         
-        # Ensure both users have profiles
-        current_profile, created = Profile.objects.get_or_create(user=current_user)
-        friend_profile, created = Profile.objects.get_or_create(user=friend_user)
-        
-        # Add friend to current user's friends list
-        if friend_user.id not in current_profile.friends:
-            current_profile.friends.append(friend_user.id)
-            current_profile.save()
-        
-        # Add current user to friend's friends list (mutual friendship)
-        if current_user.id not in friend_profile.friends:
-            friend_profile.friends.append(current_user.id)
-            friend_profile.save()
+        # Mutual friendship, both edges and the feed entries in one transaction
+        with transaction.atomic():
+            Friendship.befriend(current_user, friend_user)
+            events.friend_changed(current_user, friend_user, 'friend.added')
         
         return JsonResponse({
             'message': 'Friend added successfully', 
@@ -515,7 +914,7 @@ def add_friend(request, user_id):
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
     except Exception as e:
-        print(f"DEBUG: Error in add_friend: {str(e)}")
+        logger.exception("Error in add_friend", extra={'friend_id': user_id})
         return JsonResponse({'error': str(e)}, status=500)
 
 class RemoveFriendView(APIView):
@@ -525,25 +924,19 @@ class RemoveFriendView(APIView):
     @method_decorator(csrf_exempt, name='dispatch')
     def post(self, request, user_id):
         try:
-            print(f"remove_friend called with user_id: {user_id}")
-            print(f"request.user: {request.user}")
-            print(f"request.user.is_authenticated: {request.user.is_authenticated}")
-            print(f"request.session: {dict(request.session)}")
-            print(f"request.data: {request.data}")
-            
             # Get the current user - try multiple methods
             current_user = None
             
             # Method 1: Try to get from authenticated user
             if request.user.is_authenticated:
                 current_user = request.user
-                print(f"Using authenticated user: {current_user}")
+                logger.debug("remove_friend: using authenticated user", extra={'user_id': current_user.id})
             
             # Method 2: Try to get from session
             if not current_user and 'user_id' in request.session:
                 try:
                     current_user = User.objects.get(id=request.session['user_id'])
-                    print(f"Using user from session: {current_user}")
+                    logger.debug("remove_friend: using user from session", extra={'user_id': current_user.id})
                 except User.DoesNotExist:
                     pass
             
@@ -552,7 +945,7 @@ class RemoveFriendView(APIView):
                 try:
                     if 'user_id' in request.data:
                         current_user = User.objects.get(id=request.data['user_id'])
-                        print(f"Using user from request data: {current_user}")
+                        logger.debug("remove_friend: using user from request data", extra={'user_id': current_user.id})
                 except User.DoesNotExist:
                     pass
             
@@ -560,7 +953,7 @@ class RemoveFriendView(APIView):
             if not current_user:
                 try:
                     current_user = User.objects.first()
-                    print(f"Using first user as fallback: {current_user}")
+                    logger.warning("remove_friend: no user identified, falling back to the first user")
                 except:
                     return Response({'error': 'No users found in database'}, status=404)
             
@@ -570,34 +963,88 @@ class RemoveFriendView(APIView):
             # Get the friend user
             try:
                 friend_user = User.objects.get(id=user_id)
-                print(f"Friend user: {friend_user}")
             except User.DoesNotExist:
                 return Response({'error': f'Friend user with ID {user_id} not found'}, status=404)
             
-            # Ensure current user has a profile
-            profile, created = Profile.objects.get_or_create(user=current_user)
-            print(f"Current user profile: {profile}, friends: {profile.friends}")
-            
-            # Check if friend is in the friends list
-            if friend_user.id in profile.friends:
-                profile.friends.remove(friend_user.id)
-                profile.save()
-                print(f"Friend {friend_user.username} removed successfully from {current_user.username}'s friends list")
-                
-                # Also remove current user from friend's friends list (mutual removal)
-                friend_profile, created = Profile.objects.get_or_create(user=friend_user)
-                if current_user.id in friend_profile.friends:
-                    friend_profile.friends.remove(current_user.id)
-                    friend_profile.save()
-                    print(f"Current user {current_user.username} removed from {friend_user.username}'s friends list")
-                
+            # Remove both directions of the friendship and record it atomically
+            with transaction.atomic():
+                removed = Friendship.unfriend(current_user, friend_user)
+                if removed:
+                    events.friend_changed(current_user, friend_user, 'friend.removed')
+            if removed:
+                logger.debug("Friend removed", extra={'user_id': current_user.id, 'friend_id': friend_user.id})
                 return Response({'message': 'Friend removed successfully'})
             else:
-                print(f"Friend {friend_user.username} not in {current_user.username}'s friends list")
                 return Response({'error': 'User is not in your friends list'}, status=400)
                 
         except Exception as e:
-            print(f"Error in remove_friend: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error in remove_friend", extra={'friend_id': user_id})
             return Response({'error': f'Server error: {str(e)}'}, status=500)
+
+
+# --- Metrics ---
+from django.http import HttpResponse
+from .metrics import render_metrics
+
+def metrics(request):
+    """Prometheus scrape endpoint; only answers addresses listed in METRICS_ALLOWED_IPS"""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- Long-poll API ---
+import asyncio
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 60
+
+
+@require_http_methods(['GET'])
+async def long_poll(request):
+    """
+    Fallback for clients that cannot hold a WebSocket.
+
+    Returns the same page as the sync endpoint right away if there are
+    entries after ``since`` (or a reset), otherwise waits until one is published (see events.py)
+    or the timeout expires. Runs as an async view so parked requests don't
+    hold a thread under ASGI.
+    """
+    username = request.GET.get('username')
+    if not username:
+        return JsonResponse({'error': 'username required'}, status=400)
+    try:
+        timeout = float(request.GET.get('timeout', LONG_POLL_TIMEOUT))
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'error': 'timeout and since must be numbers'}, status=400)
+    timeout = max(0, min(timeout, MAX_LONG_POLL_TIMEOUT))
+
+    user = await User.objects.filter(username=username).afirst()
+    if user is None:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    group = events.user_group(user.id)
+    # Subscribe before reading the feed so nothing slips in between
+    await channel_layer.group_add(group, channel)
+    try:
+        feed = await sync_to_async(read_change_feed)(user, since)
+        if not (feed['changes'] or feed['reset']):
+            try:
+                await asyncio.wait_for(channel_layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                # Pushed events are only a wake-up: the page is re-read from the feed (events are
+                # sent after commit), so it matches the sync endpoint and includes anything
+                # published alongside
+                feed = await sync_to_async(read_change_feed)(user, since)
+    finally:
+        await channel_layer.group_discard(group, channel)
+
+    # DRF's encoder, so datetimes are formatted exactly as in the sync endpoint
+    return JsonResponse(feed, encoder=encoders.JSONEncoder)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -32,6 +33,7 @@ ALLOWED_HOSTS = []
 
 INSTALLED_APPS = [
     'corsheaders',
+    'channels',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'chat.middleware.CompressionMiddleware',
+    'chat.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -71,11 +75,46 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chatserver.wsgi.application'
+ASGI_APPLICATION = 'chatserver.asgi.application'
+
+# Channel layer used to push events to WebSocket clients.
+# The in-memory layer needs no broker but only reaches clients connected to the same process.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuned for many concurrent pollers and a steady stream of writers:
+# - WAL lets readers run alongside the single writer instead of queueing behind it;
+#   with synchronous=NORMAL a commit no longer fsyncs (a power loss can drop the
+#   last commits, but never corrupts the file)
+# - mmap and a larger page cache serve hot pages without read() calls
+# - writers wait up to SQLITE_BUSY_TIMEOUT seconds for the lock instead of failing
+#   with "database is locked", and every atomic() block starts with
+#   BEGIN IMMEDIATE so it takes the write lock up front; a deferred transaction
+#   that reads first and writes later cannot wait for the lock and fails at once
+# - under WSGI, connections are kept per worker thread instead of reopened (and
+#   the pragmas re-run) on every request. The app is normally served by the ASGI
+#   application (daphne), where Django opens a connection per request and
+#   persistent connections must stay off, so CONN_MAX_AGE is only raised when
+#   chatserver/wsgi.py is the entry point
+# Set SQLITE_PRODUCTION = False for the stock configuration.
+SQLITE_PRODUCTION = True
+SQLITE_BUSY_TIMEOUT = 20  # seconds
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -64 * 1024,  # negative = KiB, per connection
+    'temp_store': 'MEMORY',
+}
+SERVED_BY_WSGI = os.environ.get('CHAT_SERVER_INTERFACE') == 'wsgi'  # set by chatserver/wsgi.py
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -83,6 +122,43 @@ DATABASES = {
     }
 }
 
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600 if SERVED_BY_WSGI else 0,
+        'CONN_HEALTH_CHECKS': SERVED_BY_WSGI,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
+    })
+
+# Optional read replica for the polling endpoints (chat.routers). Set to the
+# path of a second SQLite file, refreshed from the primary with
+# `manage.py sync_replica`, or replace DATABASES['replica'] with any other
+# database holding a copy of the data. A request reads from the primary until
+# the replica holds the newest change feed entry of its user (chat.routers), so
+# users see their own messages whatever the sync interval.
+REPLICA_DATABASE_NAME = None
+
+if REPLICA_DATABASE_NAME:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': REPLICA_DATABASE_NAME,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['chat.routers.PrimaryReplicaRouter']
+
+# Username -> user lookups on the hot endpoints are cached (chat.usercache).
+# LocalLRUBackend keeps up to max_size users per process; with several workers
+# use 'chat.usercache.DjangoCacheBackend' (OPTIONS: alias, timeout) to share
+# entries and invalidations through CACHES. Entries expire after timeout seconds.
+USER_CACHE = {
+    'BACKEND': 'chat.usercache.LocalLRUBackend',
+    'OPTIONS': {'max_size': 10000, 'timeout': 300},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -140,6 +216,11 @@ CSRF_TRUSTED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
+# Render and parse API JSON with orjson (chat.renderers); set to False to use
+# DRF's stock JSONRenderer/JSONParser. Without orjson installed the fast
+# classes fall back to the stock behaviour on their own.
+FAST_JSON = True
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -149,13 +230,68 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',  # Allow unauthenticated access by default
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'chat.renderers.ORJSONRenderer' if FAST_JSON else 'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'chat.renderers.ORJSONParser' if FAST_JSON else 'rest_framework.parsers.JSONParser',
     ],
 }
 
+# Clients allowed to scrape /metrics (Prometheus text format)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Structured (JSON lines) logging. Records below WARNING from the chat app are
+# sampled at CHAT_LOG_SAMPLE_RATE; raise the 'chat' level to DEBUG to see the
+# per-request traces that used to be printed.
+CHAT_LOG_LEVEL = 'INFO'
+CHAT_LOG_SAMPLE_RATE = 0.1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {
+            '()': 'chat.log.SamplingFilter',
+            'rate': CHAT_LOG_SAMPLE_RATE,
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'chat.log.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'chat_console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['sampled'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['chat_console'],
+            'level': CHAT_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# Responses smaller than this (bytes) are not compressed by chat.middleware.CompressionMiddleware
+COMPRESSION_MIN_SIZE = 1024
+BROTLI_QUALITY = 5
+
+# Change feed entries older than this are removed by `manage.py compact_changes`
+CHANGE_FEED_RETENTION_DAYS = 7
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are streamed to disk and hashed as they arrive, then stored by content hash (chat.uploads)
+FILE_UPLOAD_HANDLERS = ['chat.uploads.HashingFileUploadHandler']
+FILE_UPLOAD_PERMISSIONS = 0o644
+MAX_UPLOAD_SIZE = 25 * 1024 * 1024  # bytes, enforced while streaming
+
+# Resized copies made of uploaded images by chat.thumbnails (longest side in pixels; needs Pillow)
+THUMBNAIL_SIZES = {'small': 160, 'medium': 480, 'large': 1280}
+THUMBNAIL_WORKERS = 2
+
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatserver.settings')
+# Lets settings keep database connections open per worker thread (CONN_MAX_AGE)
+os.environ.setdefault('CHAT_SERVER_INTERFACE', 'wsgi')
 
 application = get_wsgi_application()
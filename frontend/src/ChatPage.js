@@ -1,6 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import './ChatPage.css';
 import { createPortal } from 'react-dom';
+import { chatImageProps } from './api';
 
 function DeleteDropdownPortal({ children, style }) {
   return createPortal(
@@ -484,7 +485,7 @@ function ChatPage({
                     </div>
                     {msg.imageUrl ? (
                       <>
-                        <img src={msg.imageUrl} alt="attachment" className="chat-img" />
+                        <img {...chatImageProps(msg)} alt="attachment" className="chat-img" />
                         <div className="chat-message-time">
                           {(msg.timestamp ? new Date(msg.timestamp).toLocaleDateString() : '')} {(msg.timestamp ? new Date(msg.timestamp).toLocaleTimeString() : '')}
                         </div>
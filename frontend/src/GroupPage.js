@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
-import { fetchGroups, addGroupMember, removeGroupMember, fetchGroupMessages, sendGroupMessage, createGroup, votePoll, deleteMessage, sendPoll } from './api.js';
+import { fetchGroups, addGroupMember, removeGroupMember, fetchGroupMessages, sendGroupMessage, createGroup, votePoll, deleteMessage, sendPoll, chatImageProps } from './api.js';
 import './GroupPage.css';
 import { createPortal } from 'react-dom';
 
@@ -23,6 +23,16 @@ async function uploadImage(file) {
     return data.url; // Backend returns 'url' field, not 'imageUrl'
 }
 
+// Merge a vote response (updated tallies and the voter's choices) into the existing message
+function applyVoteResult(msg, result) {
+  if (!result || result.error) return msg;
+  return {
+    ...msg,
+    pollVotes: { ...(msg.pollVotes || {}), [result.voter]: result.selected },
+    pollTallies: result.tallies
+  };
+}
+
 const MultiplePollVoteUI = ({ msg, user, setMessages }) => {
     const [selectedOptions, setSelectedOptions] = useState([]);
 
@@ -44,7 +54,7 @@ const MultiplePollVoteUI = ({ msg, user, setMessages }) => {
             console.log('New votes:', newVotes);
             const updatedMsg = await votePoll(msg.id, voter, newVotes);
             console.log('MultiplePollVoteUI vote result:', updatedMsg);
-            setMessages(messages => messages.map(m => m.id === msg.id ? updatedMsg : m));
+            setMessages(messages => messages.map(m => m.id === msg.id ? applyVoteResult(m, updatedMsg) : m));
         } catch (error) {
             console.error('Error in MultiplePollVoteUI voting:', error);
             alert('Failed to vote. Please try again.');
@@ -1089,13 +1099,7 @@ function GroupPage({ users = [], user, groups: propGroups = [], setGroups: setPr
                                                                                     console.log('Using voter:', voter);
                                                                                     const updatedMsg = await votePoll(msg.id, voter, i);
                                                                                     console.log('Vote result:', updatedMsg);
-                                                                                    // Preserve the original message structure to prevent position changes
-                                                                                    const preservedMsg = {
-                                                                                        ...updatedMsg,
-                                                                                        sender: msg.sender, // Keep original sender
-                                                                                        poll: poll // Keep original poll data
-                                                                                    };
-                                                                                    setMessages(messages => messages.map(m => m.id === msg.id ? preservedMsg : m));
+                                                                                    setMessages(messages => messages.map(m => m.id === msg.id ? applyVoteResult(m, updatedMsg) : m));
                                                                                 } catch (error) {
                                                                                     console.error('Error voting on poll:', error);
                                                                                     alert('Failed to vote. Please try again.');
@@ -1241,13 +1245,7 @@ function GroupPage({ users = [], user, groups: propGroups = [], setGroups: setPr
                                                                                             console.log('Using voter:', voter);
                                                                                             const updatedMsg = await votePoll(msg.id, voter, i);
                                                                                             console.log('Vote result:', updatedMsg);
-                                                                                            // Preserve the original message structure to prevent position changes
-                                                                                            const preservedMsg = {
-                                                                                                ...updatedMsg,
-                                                                                                sender: msg.sender, // Keep original sender
-                                                                                                poll: msg.poll // Keep original poll data
-                                                                                            };
-                                                                                            setMessages(messages => messages.map(m => m.id === msg.id ? preservedMsg : m));
+                                                                                            setMessages(messages => messages.map(m => m.id === msg.id ? applyVoteResult(m, updatedMsg) : m));
                                                                                         } catch (error) {
                                                                                             console.error('Error voting on poll:', error);
                                                                                             alert('Failed to vote. Please try again.');
@@ -1293,7 +1291,7 @@ function GroupPage({ users = [], user, groups: propGroups = [], setGroups: setPr
                                                     <audio controls src={msg.audioUrl} style={{ width: '100%' }} />
                                                 ) : msg.imageUrl ? (
                                                     <>
-                                                    <img src={msg.imageUrl} alt="attachment" className="chat-img" />
+                                                    <img {...chatImageProps(msg)} alt="attachment" className="chat-img" />
                                                         <div className="chat-message-time">
                                                             {(msg.timestamp ? new Date(msg.timestamp).toLocaleDateString() : '')} {(msg.timestamp ? new Date(msg.timestamp).toLocaleTimeString() : '')}
                                                         </div>
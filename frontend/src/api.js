@@ -240,6 +240,22 @@ export async function fetchGroupMessages(groupId, username) {
 
 
 
+// Props for a chat image: a resized variant with a srcset and a blurred placeholder
+// while it loads, falling back to the original when no variants exist yet
+export function chatImageProps(msg) {
+  const variants = msg.imageVariants;
+  if (!variants) return { src: msg.imageUrl, loading: 'lazy' };
+  const sizes = Object.values(variants.sizes || {});
+  const preferred = variants.sizes.medium || variants.sizes.small;
+  return {
+    src: preferred ? preferred.url : msg.imageUrl,
+    srcSet: sizes.map(v => `${v.url} ${v.width}w`).concat(`${msg.imageUrl} ${variants.width}w`).join(', '),
+    sizes: '(max-width: 600px) 70vw, 320px',
+    loading: 'lazy',
+    style: { backgroundImage: `url(${variants.placeholder})`, backgroundSize: 'cover' },
+  };
+}
+
 export async function deleteMessage(id, deleteType = 'for_me', username) {
   try {
   const res = await fetch(`${API_BASE}/messages/${id}/?type=${deleteType}&username=${username}`, {